@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from llmscheduler import BATCH, get_scheduler, set_default_priority
+from pipeline import PDF_PATH, STAGE_TIMEOUT, ReportPipeline, SharedResources
+
+
+def read_watchlist(path):
+    # One ticker per line; blank lines and "#" comments are ignored, duplicates dropped
+    with open(path, encoding="utf-8") as f:
+        lines = [line.split("#", 1)[0].strip() for line in f]
+    return list(dict.fromkeys(line for line in lines if line))
+
+
+def report_dir(output_dir, company):
+    return os.path.join(output_dir, re.sub(r"[^A-Za-z0-9._-]", "_", company))
+
+
+def write_report(output_dir, report):
+    folder = report_dir(output_dir, report["company"])
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, "report.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+    return path
+
+
+def run_batch(watchlist, openai_api_key, output_dir, workers=4, stage_timeout=STAGE_TIMEOUT, pdf_path=PDF_PATH):
+    resources = SharedResources(pdf_path)
+
+    # Work shared by every report happens once, before the workers start: the
+    # macro index for this run and one bulk download of weekly bars
+    try:
+        resources.macro_vectorstore(openai_api_key)
+    except Exception as e:
+        # Only the macro stage depends on the index; it reports itself unavailable per company
+        print(f"Macro index unavailable: {type(e).__name__}: {e}")
+    try:
+        resources.ohlcv_store.update(watchlist)
+    except Exception as e:
+        # Each technical stage tops up its own ticker's bars when they are missing or stale
+        print(f"Bulk OHLCV download failed: {type(e).__name__}: {e}")
+
+    pipeline = ReportPipeline(openai_api_key, resources, stage_timeout)
+    os.makedirs(output_dir, exist_ok=True)
+
+    def run_one(company):
+        started = time.time()
+        report = pipeline.run(company)
+        report["seconds"] = round(time.time() - started, 2)
+        return report
+
+    summary = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_one, company): company for company in watchlist}
+        for future in as_completed(futures):
+            company = futures[future]
+            try:
+                report = future.result()
+                summary[company] = {"status": "ok", "path": write_report(output_dir, report), "seconds": report["seconds"]}
+            except Exception as e:
+                summary[company] = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+            print(f"[{len(summary)}/{len(watchlist)}] {company}: {summary[company]['status']}")
+
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+    print(f"LLM scheduler: {json.dumps(get_scheduler().metrics())}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run ValuateGPT reports for every ticker in a watchlist.")
+    parser.add_argument("watchlist", help="text file with one ticker per line")
+    parser.add_argument("--output-dir", default="reports", help="directory for report.json files and summary.json")
+    parser.add_argument("--workers", type=int, default=4, help="number of reports to run at the same time")
+    parser.add_argument("--stage-timeout", type=int, default=STAGE_TIMEOUT, help="seconds before a stage is reported as unavailable")
+    parser.add_argument("--macro-corpus", default=PDF_PATH, help="macro report PDF, or a directory of them")
+    parser.add_argument("--openai-api-key", default=os.environ.get("OPENAI_API_KEY"), help="defaults to $OPENAI_API_KEY")
+    args = parser.parse_args()
+
+    if not args.openai_api_key:
+        parser.error("an OpenAI API key is required (--openai-api-key or $OPENAI_API_KEY)")
+    # Batch requests queue behind interactive ones in the shared LLM scheduler
+    set_default_priority(BATCH)
+    run_batch(read_watchlist(args.watchlist), args.openai_api_key, args.output_dir, args.workers, args.stage_timeout, args.macro_corpus)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import statistics
+import sys
+import tempfile
+import time
+import types
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Offline benchmark for the full report pipeline. OpenAI, yfinance and the news
+# scraper are replaced by local stand-ins that serve fixtures after a
+# configurable delay, so latency and throughput can be measured without network
+# access. Fixtures are either recorded once with --record or, with --synthetic,
+# generated per ticker. Recorded chat responses are replayed when a prompt
+# matches one seen while recording; any other prompt gets a synthetic answer.
+
+ANALYST_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PDF = os.path.join(ANALYST_DIR, "US_Economic_Forecast_Deloitte.pdf")
+DEFAULT_FIXTURES = os.path.join(ANALYST_DIR, "benchmark_fixtures")
+LLM_FIXTURES = "llm_responses.json"
+DEFAULT_TICKERS = ["AAPL", "MSFT", "GOOGL", "AMZN", "META", "NVDA"]
+STATEMENTS = ("balance_sheet", "financials", "cashflow")
+CHOSEN_RATIOS = ("Gross Margin", "Net Profit Margin", "Return on Equity", "Current Ratio", "Debt to Equity", "Free Cash Flow Yield")
+
+
+def synthetic_fixture(ticker):
+    from ratioengine import LINE_ITEMS
+
+    rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+    periods = pd.to_datetime(["2024-12-31", "2023-12-31"])
+    revenue = rng.uniform(1e10, 4e11)
+
+    rows = {statement: {} for statement in STATEMENTS}
+    for item, (statement, labels) in LINE_ITEMS.items():
+        values = revenue * rng.uniform(0.05, 1.2, size=len(periods))
+        if item == "capital_expenditure":
+            values = -values * 0.1
+        rows[statement][labels[0]] = values
+    fixture = {
+        statement: pd.DataFrame.from_dict(items, orient="index", columns=periods)
+        for statement, items in rows.items()
+    }
+    fixture["info"] = {
+        "shortName": f"{ticker} Inc.",
+        "sector": "Technology",
+        "industry": "Software",
+        "currency": "USD",
+        "marketCap": revenue * rng.uniform(2, 10),
+    }
+
+    dates = pd.date_range(end=pd.Timestamp.today().normalize(), periods=60, freq="W-MON")
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.03, len(dates))))
+    fixture["bars"] = pd.DataFrame({
+        "Open": close * rng.uniform(0.98, 1.02, len(dates)),
+        "High": close * 1.03,
+        "Low": close * 0.97,
+        "Close": close,
+        "Volume": rng.integers(1_000_000, 50_000_000, len(dates)).astype("float64"),
+    }, index=dates)
+    return fixture
+
+
+def prompt_key(prompt_text):
+    return hashlib.sha256(prompt_text.encode("utf-8")).hexdigest()
+
+
+def record_articles(ticker):
+    import newselenium
+
+    extractor = newselenium.NewsExtractor(ticker)
+    extractor.fetch_articles()
+    path = os.path.join(tempfile.mkdtemp(prefix="valuategpt-record-"), "news.json")
+    extractor.save_to_json(path)
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def record_fixtures(tickers, fixtures_dir):
+    # Capture real yfinance data and scraped news once so later benchmark runs can replay them
+    import yfinance as yf
+
+    os.makedirs(fixtures_dir, exist_ok=True)
+    bars = yf.download(tickers, period="1y", interval="1wk", group_by="ticker", progress=False)
+    for ticker in tickers:
+        t = yf.Ticker(ticker)
+        fixture = {statement: getattr(t, statement) for statement in STATEMENTS}
+        fixture["info"] = t.info
+        fixture["bars"] = bars[ticker] if isinstance(bars.columns, pd.MultiIndex) else bars
+        fixture["articles"] = record_articles(ticker)
+        with open(os.path.join(fixtures_dir, f"{ticker}.pkl"), "wb") as f:
+            pickle.dump(fixture, f)
+        print(f"recorded {ticker}")
+
+
+def record_llm_responses(tickers, fixtures_dir, openai_api_key):
+    # Run the live pipeline once per ticker and keep every chat response by prompt.
+    # A fresh cache directory makes sure every call really reaches OpenAI.
+    workdir = tempfile.mkdtemp(prefix="valuategpt-record-")
+    os.environ["VALUATEGPT_CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.chdir(workdir)
+    import llmscheduler
+    import pipeline
+
+    scheduler = llmscheduler.get_scheduler()
+    run, stream = scheduler.run, scheduler.stream
+    responses = {}
+
+    def recording_run(call, model, prompt_text, **kwargs):
+        result = run(call, model, prompt_text, **kwargs)
+        # Chat models return a message, completion models a string; embedding
+        # requests go through the scheduler too, but only text is kept
+        text = getattr(result, "content", result)
+        if isinstance(text, str):
+            responses[prompt_key(prompt_text)] = text
+        return result
+
+    def recording_stream(call, model, prompt_text, **kwargs):
+        chunks = []
+        for chunk in stream(call, model, prompt_text, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        responses[prompt_key(prompt_text)] = "".join(chunks)
+
+    scheduler.run, scheduler.stream = recording_run, recording_stream
+    report_pipeline = pipeline.ReportPipeline(openai_api_key)
+    for ticker in tickers:
+        report_pipeline.run(ticker)
+        print(f"recorded LLM responses for {ticker}")
+    with open(os.path.join(fixtures_dir, LLM_FIXTURES), "w", encoding="utf-8") as f:
+        json.dump(responses, f, indent=2)
+
+
+class FixtureSet:
+    # Recorded fixtures from fixtures_dir, or synthetic ones for every ticker
+    # when fixtures_dir is None
+    def __init__(self, fixtures_dir=None):
+        self.fixtures_dir = fixtures_dir
+        self._fixtures = {}
+        self._llm_responses = None
+
+    def missing(self, tickers):
+        if self.fixtures_dir is None:
+            return []
+        return [t for t in tickers if not os.path.exists(os.path.join(self.fixtures_dir, f"{t}.pkl"))]
+
+    def get(self, ticker):
+        if ticker not in self._fixtures:
+            if self.fixtures_dir is None:
+                self._fixtures[ticker] = synthetic_fixture(ticker)
+            else:
+                with open(os.path.join(self.fixtures_dir, f"{ticker}.pkl"), "rb") as f:
+                    self._fixtures[ticker] = pickle.load(f)
+        return self._fixtures[ticker]
+
+    def llm_responses(self):
+        if self._llm_responses is None:
+            self._llm_responses = {}
+            path = os.path.join(self.fixtures_dir, LLM_FIXTURES) if self.fixtures_dir else None
+            if path and os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    self._llm_responses = json.load(f)
+        return self._llm_responses
+
+
+def fake_yfinance(fixtures, latency):
+    class Ticker:
+        def __init__(self, symbol, session=None):
+            self.symbol = symbol
+
+        def _get(self, kind):
+            time.sleep(latency)
+            return fixtures.get(self.symbol)[kind]
+
+        balance_sheet = property(lambda self: self._get("balance_sheet"))
+        financials = property(lambda self: self._get("financials"))
+        cashflow = property(lambda self: self._get("cashflow"))
+        info = property(lambda self: self._get("info"))
+
+    def download(tickers, start=None, **kwargs):
+        time.sleep(latency)
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        frames = {}
+        for ticker in tickers:
+            bars = fixtures.get(ticker)["bars"]
+            frames[ticker] = bars[bars.index >= pd.Timestamp(start)] if start is not None else bars
+        return pd.concat(frames, axis=1)
+
+    return types.SimpleNamespace(Ticker=Ticker, download=download)
+
+
+def fake_newselenium(fixtures, latency):
+    module = types.ModuleType("newselenium")
+
+    class NewsExtractor:
+        def __init__(self, keyword):
+            self.keyword = keyword
+            self.articles = []
+
+        def fetch_articles(self):
+            time.sleep(latency)
+            recorded = fixtures.get(self.keyword).get("articles")
+            if recorded:
+                self.articles = recorded
+                return
+            wire = f"{self.keyword} reported quarterly revenue ahead of estimates as demand for its products held up. " * 20
+            self.articles = [
+                {"title": f"{self.keyword} story {i}", "content": f"Article {i} on {self.keyword}. " + "Analysts weigh margins, guidance and rates. " * 40}
+                for i in range(8)
+            ]
+            # Syndicated copies of the same wire story
+            self.articles += [{"title": f"{self.keyword} wire copy {i}", "content": wire} for i in range(4)]
+
+        def save_to_json(self, path):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.articles, f)
+
+    module.NewsExtractor = NewsExtractor
+    return module
+
+
+def fake_response(text, peers):
+    # The weighting prompt also mentions ticker symbols, so it is matched first
+    if "assign weights" in text:
+        return " ".join(f"{1 / len(peers):.3f}" for _ in peers)
+    if "ticker symbols" in text:
+        return " ".join(peers)
+    if "Choose only from these ratios" in text:
+        return "****".join(CHOSEN_RATIOS)
+    if "ask 10 questions" in text:
+        return "********".join(f"How do interest rates and inflation affect sector growth, question {i}?" for i in range(10))
+    return "Synthetic analysis: demand is steady, margins are stable and rates remain the main risk. " * 12
+
+
+def fake_models(latency, embedding_latency, peers, responses):
+    from langchain_core.embeddings import Embeddings
+    from langchain_core.language_models.chat_models import SimpleChatModel
+    from langchain_core.messages import get_buffer_string
+
+    class FakeChatModel(SimpleChatModel):
+        model_name: str = "fake-chat"
+        temperature: float = 0.0
+        latency: float = 0.0
+
+        @property
+        def _llm_type(self):
+            return "fake-chat"
+
+        def _call(self, messages, stop=None, run_manager=None, **kwargs):
+            time.sleep(self.latency)
+            # Chat prompts were recorded as their message buffer, completion prompts as plain text
+            text = " ".join(str(m.content) for m in messages)
+            for key in (prompt_key(get_buffer_string(messages)), prompt_key(text)):
+                if key in responses:
+                    return responses[key]
+            return fake_response(text, peers)
+
+    class FakeEmbeddings(Embeddings):
+        model = "fake-embedding"
+
+        def embed_documents(self, texts):
+            time.sleep(embedding_latency)
+            return [np.random.default_rng(zlib.crc32(t.encode())).normal(size=256).astype("float32").tolist() for t in texts]
+
+        def embed_query(self, text):
+            return self.embed_documents([text])[0]
+
+    def chat_model(**kwargs):
+        name = kwargs.get("model") or kwargs.get("model_name") or "fake-chat"
+        return FakeChatModel(model_name=name, temperature=kwargs.get("temperature", 0.7), latency=latency)
+
+    return chat_model, lambda **kwargs: FakeEmbeddings()
+
+
+def percentile(values, q):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def summarize_spans(spans):
+    summary = defaultdict(lambda: defaultdict(float))
+    for span in spans:
+        name = f"{span.name}:{span.attrs['site']}" if "site" in span.attrs else span.name
+        if span.name == "stage":
+            name = f"stage:{span.attrs['stage']}"
+        row = summary[name]
+        row["count"] += 1
+        row["total_ms"] += span.duration_ms or 0.0
+        for counter, value in span.counters.items():
+            row[counter] += value
+    return {name: {k: round(v, 3) for k, v in row.items()} for name, row in sorted(summary.items())}
+
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="valuategpt-bench-")
+    # Module-level cache paths are read at import time, so set them before importing the pipeline
+    os.environ["VALUATEGPT_CACHE_DIR"] = args.cache_dir or os.path.join(workdir, "cache")
+    os.environ["VALUATEGPT_TRACE_PATH"] = args.trace or os.path.join(workdir, "trace.jsonl")
+    os.environ.pop("VALUATEGPT_OFFLINE", None)
+    fixtures = FixtureSet(None if args.synthetic else args.fixtures)
+    sys.modules["newselenium"] = fake_newselenium(fixtures, args.scrape_latency)
+    # The news stage writes its scraped JSON into the working directory
+    os.chdir(workdir)
+
+    import financialdata
+    import ohlcvstore
+    import industrypeer
+    import macroanalysis
+    import newsanalyst
+    import technicalanalyst
+    import pipeline
+    import llmcache
+    import llmscheduler
+    import tracing
+
+    yf_stand_in = fake_yfinance(fixtures, args.http_latency)
+    financialdata.yf = yf_stand_in
+    ohlcvstore.yf = yf_stand_in
+    chat_model, embeddings = fake_models(args.llm_latency, args.embedding_latency, args.tickers, fixtures.llm_responses())
+    for module in (industrypeer, macroanalysis, newsanalyst, technicalanalyst, pipeline):
+        module.ChatOpenAI = chat_model
+    pipeline.OpenAI = chat_model
+    macroanalysis.OpenAIEmbeddings = embeddings
+    pipeline.OpenAIEmbeddings = embeddings
+    if not args.rate_limits:
+        llmscheduler.get_scheduler().limits = {}
+
+    resources = pipeline.SharedResources(args.pdf)
+    report_pipeline = pipeline.ReportPipeline("benchmark", resources)
+    companies = [args.tickers[i % len(args.tickers)] for i in range(args.reports)]
+
+    def run_one(company):
+        started = time.perf_counter()
+        report_pipeline.run(company)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        latencies = sorted(executor.map(run_one, companies))
+    wall = time.perf_counter() - started
+
+    return {
+        "fixtures": "synthetic" if args.synthetic else args.fixtures,
+        "reports": len(companies),
+        "workers": args.workers,
+        "wall_seconds": round(wall, 3),
+        "reports_per_minute": round(len(companies) / wall * 60, 2),
+        "latency_seconds": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "max": round(latencies[-1], 3),
+        },
+        "llm_cache": llmcache.get_cache().stats(),
+        "scheduler": llmscheduler.get_scheduler().metrics(),
+        "spans": summarize_spans(tracing.get_tracer().spans),
+        "trace_path": os.environ["VALUATEGPT_TRACE_PATH"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ValuateGPT pipeline offline against local stand-ins.")
+    parser.add_argument("--tickers", nargs="+", default=DEFAULT_TICKERS)
+    parser.add_argument("--reports", type=int, default=len(DEFAULT_TICKERS), help="number of reports to run")
+    parser.add_argument("--workers", type=int, default=4, help="reports running at the same time")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per chat completion")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="seconds per embeddings request")
+    parser.add_argument("--http-latency", type=float, default=0.1, help="seconds per yfinance request")
+    parser.add_argument("--scrape-latency", type=float, default=1.0, help="seconds per news scrape")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="directory of recorded <TICKER>.pkl fixtures")
+    parser.add_argument("--synthetic", action="store_true", help="generate synthetic fixtures instead of replaying recorded ones")
+    parser.add_argument("--record", action="store_true", help="record yfinance, news and (with $OPENAI_API_KEY) OpenAI fixtures for --tickers, then exit")
+    parser.add_argument("--pdf", default=DEFAULT_PDF, help="macro corpus PDF or directory of PDFs")
+    parser.add_argument("--cache-dir", help="reuse a cache directory to measure warm runs (default: fresh temp dir)")
+    parser.add_argument("--trace", help="JSON lines file for spans (default: inside the temp dir)")
+    parser.add_argument("--rate-limits", action="store_true", help="keep the scheduler's default rate limits")
+    args = parser.parse_args()
+
+    if args.record:
+        args.fixtures = os.path.abspath(args.fixtures)
+        record_fixtures(args.tickers, args.fixtures)
+        if os.environ.get("OPENAI_API_KEY"):
+            record_llm_responses(args.tickers, args.fixtures, os.environ["OPENAI_API_KEY"])
+        else:
+            print("OPENAI_API_KEY is not set; chat responses will stay synthetic")
+        return
+    args.fixtures = os.path.abspath(args.fixtures)
+    missing = FixtureSet(None if args.synthetic else args.fixtures).missing(args.tickers)
+    if missing:
+        parser.error(
+            f"no recorded fixtures for {', '.join(missing)} in {args.fixtures}; "
+            "record them with --record or run with --synthetic"
+        )
+    args.pdf = os.path.abspath(args.pdf)
+    if args.trace:
+        args.trace = os.path.abspath(args.trace)
+    if args.cache_dir:
+        args.cache_dir = os.path.abspath(args.cache_dir)
+    print(json.dumps(run_benchmark(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from financialdata import CACHE_DIR
+from llmscheduler import estimate_tokens, get_scheduler
+import tracing
+
+
+def chunk_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    # Embeddings keyed by (model, chunk-content hash); only unseen chunks reach the API
+    def __init__(self, embeddings, path=None, batch_size=256, max_workers=4):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", "") or type(embeddings).__name__
+        self.path = path or os.path.join(CACHE_DIR, "embeddings.sqlite3")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.last_embedded_count = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, hashes):
+        found = {}
+        hashes = list(hashes)
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [self.model, *batch],
+                )
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, vectors):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(self.model, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in vectors.items()],
+            )
+            self._conn.commit()
+
+    def _embed_batch(self, batch):
+        hashes, texts = zip(*batch)
+        # The embeddings client doesn't return usage, so this is an estimate
+        tracing.record(http_calls=1, tokens_in_est=sum(estimate_tokens(text) for text in texts))
+        vectors = get_scheduler().run(
+            lambda: self.embeddings.embed_documents(list(texts)),
+            self.model, "".join(texts), expected_output_tokens=0,
+        )
+        return dict(zip(hashes, vectors))
+
+    def embed(self, texts):
+        with tracing.span("embed", model=self.model) as span:
+            hashes = [chunk_hash(text) for text in texts]
+            vectors = self.get_many(set(hashes))
+            missing = {h: text for h, text in zip(hashes, texts) if h not in vectors}
+            span.record(cache_hits=len(set(hashes)) - len(missing), cache_misses=len(missing))
+
+            if missing:
+                items = list(missing.items())
+                batches = [items[i:i + self.batch_size] for i in range(0, len(items), self.batch_size)]
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    for embedded in executor.map(tracing.propagate(self._embed_batch), batches):
+                        self.put_many(embedded)
+                        vectors.update({h: np.asarray(v, dtype=np.float32) for h, v in embedded.items()})
+
+        self.last_embedded_count = len(missing)
+        return [vectors[h] for h in hashes]
@@ -0,0 +1,113 @@
+import os
+import pickle
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import yfinance as yf
+import pandas as pd
+import tracing
+
+CACHE_DIR = os.environ.get(
+    "VALUATEGPT_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"),
+)
+
+# Statements only change when a company reports; info (price, market cap) moves intraday
+STATEMENT_TTL = 90 * 24 * 3600
+INFO_TTL = 3600
+STATEMENTS = ("balance_sheet", "financials", "cashflow")
+
+
+def make_session(pool_size):
+    # Recent yfinance releases expect a curl_cffi session; older ones take requests
+    try:
+        from curl_cffi import requests as curl_requests
+        return curl_requests.Session(impersonate="chrome")
+    except ImportError:
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+
+class FinancialDataFetcher:
+    def __init__(self, cache_dir=None, max_workers=8, offline=None, session=None):
+        self.cache_dir = os.path.join(cache_dir or CACHE_DIR, "financials")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.max_workers = max_workers
+        # Offline mode serves whatever is cached, regardless of age, and never hits the network
+        if offline is None:
+            offline = os.environ.get("VALUATEGPT_OFFLINE") == "1"
+        self.offline = offline
+        self.session = session
+        # Concurrent requests for the same ticker wait for the first one and then hit the cache
+        self._ticker_locks = defaultdict(threading.Lock)
+        self._locks_guard = threading.Lock()
+        if self.session is None and not self.offline:
+            self.session = make_session(max_workers)
+
+    def _cache_path(self, ticker_symbol, kind):
+        name = ticker_symbol.upper().replace(os.sep, "_")
+        return os.path.join(self.cache_dir, f"{name}.{kind}.pkl")
+
+    def _read_cache(self, ticker_symbol, kind, ttl):
+        path = self._cache_path(ticker_symbol, kind)
+        if not os.path.exists(path):
+            return None
+        if not self.offline and time.time() - os.path.getmtime(path) > ttl:
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def _write_cache(self, ticker_symbol, kind, value):
+        path = self._cache_path(ticker_symbol, kind)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _empty(kind):
+        return {} if kind == "info" else pd.DataFrame()
+
+    def _ticker_lock(self, ticker_symbol):
+        with self._locks_guard:
+            return self._ticker_locks[ticker_symbol.upper()]
+
+    def fetch(self, ticker_symbol):
+        with self._ticker_lock(ticker_symbol):
+            return self._fetch(ticker_symbol)
+
+    def _fetch(self, ticker_symbol):
+        data = {}
+        ticker = None
+        for kind in STATEMENTS + ("info",):
+            ttl = INFO_TTL if kind == "info" else STATEMENT_TTL
+            value = self._read_cache(ticker_symbol, kind, ttl)
+            if value is None and not self.offline:
+                if ticker is None:
+                    ticker = yf.Ticker(ticker_symbol, session=self.session)
+                try:
+                    tracing.record(http_calls=1)
+                    value = getattr(ticker, kind)
+                except Exception:
+                    # One bad peer shouldn't sink the whole comparison
+                    value = None
+                # Don't pin a failed or empty response in the cache for a whole quarter
+                if value is not None and len(value):
+                    self._write_cache(ticker_symbol, kind, value)
+            data[kind] = value if value is not None else self._empty(kind)
+        return data
+
+    def fetch_all(self, tickers):
+        tickers = list(dict.fromkeys(tickers))
+        if not tickers:
+            return {}
+        with tracing.span("peer.fetch", tickers=len(tickers)):
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(tickers))) as executor:
+                results = list(executor.map(tracing.propagate(self.fetch), tickers))
+        return dict(zip(tickers, results))
@@ -0,0 +1,140 @@
+import heapq
+import math
+import re
+import threading
+import weakref
+from collections import Counter, defaultdict
+import numpy as np
+from llmscheduler import estimate_tokens
+
+# Numbers keep their decimals and percent sign so "5.25%" matches as one term
+TOKEN_PATTERN = re.compile(r"\d+(?:[.,]\d+)*%?|[a-z][a-z0-9'-]*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it its of on or that the "
+    "this to was were what when which will with would".split()
+)
+
+
+def tokenize(text):
+    return [term for term in TOKEN_PATTERN.findall(text.lower()) if term not in STOPWORDS]
+
+
+class BM25Index:
+    # Inverted index over the chunk texts, scored with Okapi BM25
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.doc_lengths = []
+        for doc_index, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            self.doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((doc_index, tf))
+        n = len(self.doc_lengths)
+        self.avg_length = (sum(self.doc_lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query, k):
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_index, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_index] / self.avg_length)
+                scores[doc_index] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores, key=scores.get)
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] += 1 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class HybridRetriever:
+    # BM25 and FAISS candidates are fused with reciprocal rank fusion, then
+    # reranked by embedding similarity plus how many question terms each chunk
+    # contains. Only chunks close to the best one are kept, up to a per-question
+    # token budget, and the best chunk is always kept.
+    candidate_k = 20
+    rrf_k = 60
+    lexical_weight = 0.3
+    min_relevance = 0.9  # fraction of the best chunk's score
+    token_budget = 1500
+
+    def __init__(self, vectorstore, **settings):
+        for name, value in settings.items():
+            if not hasattr(self, name):
+                raise TypeError(f"unknown setting {name!r}")
+            setattr(self, name, value)
+        self.vectorstore = vectorstore
+        self.positions = sorted(vectorstore.index_to_docstore_id)
+        self.rows = {position: row for row, position in enumerate(self.positions)}
+        self.doc_ids = [vectorstore.index_to_docstore_id[position] for position in self.positions]
+        self.docs = [vectorstore.docstore.search(doc_id) for doc_id in self.doc_ids]
+        texts = [doc.page_content for doc in self.docs]
+        self.lexical = BM25Index(texts)
+        self.terms = [set(tokenize(text)) for text in texts]
+        self.tokens = [estimate_tokens(text) for text in texts]
+
+    def search(self, questions, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        _, dense = self.vectorstore.index.search(vectors, self.candidate_k)
+        results = []
+        for question, vector, dense_row in zip(questions, _normalize(vectors), dense):
+            dense_ranking = [self.rows[int(i)] for i in dense_row if i != -1]
+            lexical_ranking = self.lexical.search(question, self.candidate_k)
+            candidates = reciprocal_rank_fusion([dense_ranking, lexical_ranking], self.rrf_k)[:self.candidate_k]
+            results.append(self.select(self.rerank(question, vector, candidates)))
+        return results
+
+    def rerank(self, question, vector, rows):
+        if not rows:
+            return []
+        terms = set(tokenize(question))
+        chunk_vectors = _normalize(np.vstack([self.vectorstore.index.reconstruct(self.positions[row]) for row in rows]))
+        similarity = chunk_vectors @ vector
+        scored = []
+        for row, sim in zip(rows, similarity):
+            coverage = len(terms & self.terms[row]) / len(terms) if terms else 0.0
+            scored.append(((1 - self.lexical_weight) * float(sim) + self.lexical_weight * coverage, row))
+        scored.sort(reverse=True)
+        return scored
+
+    def select(self, ranked):
+        selected = []
+        used = 0
+        best = ranked[0][0] if ranked else 0.0
+        for score, row in ranked:
+            if selected and score < best * self.min_relevance:
+                break
+            if selected and used + self.tokens[row] > self.token_budget:
+                continue
+            selected.append((self.doc_ids[row], self.docs[row]))
+            used += self.tokens[row]
+        return selected
+
+
+_retrievers = weakref.WeakKeyDictionary()
+_retrievers_lock = threading.Lock()
+
+
+def retriever_for(vectorstore):
+    # The lexical index is built once per loaded vectorstore and shared by every analyzer using it
+    with _retrievers_lock:
+        retriever = _retrievers.get(vectorstore)
+        if retriever is None:
+            retriever = _retrievers[vectorstore] = HybridRetriever(vectorstore)
+        return retriever
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import faiss
+from langchain.vectorstores import FAISS
+from financialdata import CACHE_DIR
+
+INDEX_DIR = os.path.join(CACHE_DIR, "faiss")
+
+
+def source_key(paths, **params):
+    # Content address of an index: the source bytes plus everything that shapes the chunks
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()[:32]
+
+
+def index_path(key):
+    return os.path.join(INDEX_DIR, key)
+
+
+def save_index(vectorstore, key, manifest=None):
+    folder = index_path(key)
+    tmp_folder = f"{folder}.{os.getpid()}.tmp"
+    os.makedirs(tmp_folder, exist_ok=True)
+    faiss.write_index(vectorstore.index, os.path.join(tmp_folder, "index.faiss"))
+    with open(os.path.join(tmp_folder, "index.pkl"), "wb") as f:
+        pickle.dump((vectorstore.docstore, vectorstore.index_to_docstore_id), f)
+    with open(os.path.join(tmp_folder, "manifest.json"), "w") as f:
+        json.dump(dict(manifest or {}, key=key), f)
+    # Swap the finished folder in so readers never see a half-written index
+    if os.path.exists(folder):
+        shutil.rmtree(folder, ignore_errors=True)
+    os.replace(tmp_folder, folder)
+    if manifest and "source" in manifest:
+        remove_superseded(manifest["source"], key)
+
+
+def _manifests():
+    # (key, manifest, mtime) for every saved index
+    if not os.path.isdir(INDEX_DIR):
+        return
+    for key in os.listdir(INDEX_DIR):
+        manifest_path = os.path.join(INDEX_DIR, key, "manifest.json")
+        if not os.path.exists(manifest_path):
+            continue
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        yield key, manifest, os.path.getmtime(manifest_path)
+
+
+def remove_superseded(source, key):
+    # Older editions of the same source are never loaded again once a newer index
+    # is saved; processes that still have one memory-mapped keep their open file
+    for old_key, manifest, _ in list(_manifests()):
+        if manifest.get("source") == source and old_key != key:
+            shutil.rmtree(index_path(old_key), ignore_errors=True)
+
+
+def latest_index_key(source):
+    # Most recently written index built from the same source, for incremental updates
+    latest, latest_mtime = None, -1.0
+    for _, manifest, mtime in _manifests():
+        if manifest.get("source") == source and mtime > latest_mtime:
+            latest, latest_mtime = manifest["key"], mtime
+    return latest
+
+
+def load_index(key, embeddings, mmap=True):
+    folder = index_path(key)
+    path = os.path.join(folder, "index.faiss")
+    if not os.path.exists(path):
+        return None
+    index = None
+    if mmap:
+        try:
+            index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Not every index type can be memory-mapped
+            index = None
+    if index is None:
+        index = faiss.read_index(path)
+    with open(os.path.join(folder, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from langchain.schema.output_parser import StrOutputParser
+from langchain.schema.runnable import RunnableLambda
+from financialdata import CACHE_DIR
+from llmscheduler import estimate_tokens, get_scheduler
+import tracing
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# How long a response stays valid at each call site. Keys include the rendered
+# prompt, so a site only needs a short TTL when the same prompt can go stale.
+TTLS = {
+    "peer.similar_companies": 7 * DAY,
+    "peer.weights": 7 * DAY,
+    "peer.ratios_to_compare": 7 * DAY,
+    "macro.questions": 7 * DAY,
+    "macro.answer": 7 * DAY,
+    "macro.analysis": DAY,
+    "news.analysis": DAY,
+    "news.chunk_summary": DAY,
+    "technical.analysis": DAY,
+    "final.recommendation": DAY,
+}
+DEFAULT_TTL = DAY
+
+
+class LLMCache:
+    def __init__(self, path=None, max_entries=20000, max_bytes=256 * 1024 * 1024):
+        self.path = path or os.path.join(CACHE_DIR, "llm_cache.sqlite3")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, site TEXT, response TEXT NOT NULL, "
+            "created REAL NOT NULL, last_access REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name, temperature, prompt_text):
+        payload = json.dumps([model_name, temperature, prompt_text])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key, site, ttl):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses[site] += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits[site] += 1
+            return row[0]
+
+    def put(self, key, site, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, site, response, created, last_access, size) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, site, response, now, now, len(response.encode("utf-8"))),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Drop least recently used entries until both the count and size limits hold
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        stale = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            stale.append((key,))
+            count -= 1
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def stats(self):
+        sites = sorted(set(self.hits) | set(self.misses))
+        return {
+            "hits": sum(self.hits.values()),
+            "misses": sum(self.misses.values()),
+            "sites": {site: {"hits": self.hits[site], "misses": self.misses[site]} for site in sites},
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    # One cache per process, shared by every analyzer
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
+
+
+def model_signature(model):
+    name = getattr(model, "model_name", None) or getattr(model, "model", None) or type(model).__name__
+    return name, getattr(model, "temperature", None)
+
+
+def _prompt_key(store, model, prompt_text):
+    model_name, temperature = model_signature(model)
+    return store.make_key(model_name, temperature, prompt_text)
+
+
+def message_usage(message):
+    # Token counts reported by the provider, or None; completion models return
+    # plain strings, which carry no usage
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return None
+    return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+
+
+def token_counts(prompt_text, response, usage):
+    # Real usage when the provider reported it. Otherwise a tiktoken estimate,
+    # recorded under its own *_est counters so the two never get summed together.
+    if usage is not None:
+        return {"tokens_in": usage[0], "tokens_out": usage[1]}
+    return {"tokens_in_est": estimate_tokens(prompt_text), "tokens_out_est": estimate_tokens(response)}
+
+
+def cached_chain(prompt, model, site, ttl=None, cache=None):
+    # Drop-in for `prompt | model | StrOutputParser()` that memoizes on the rendered prompt
+    ttl = TTLS.get(site, DEFAULT_TTL) if ttl is None else ttl
+    parser = StrOutputParser()
+
+    def run(inputs):
+        store = cache or get_cache()
+        model_name = model_signature(model)[0]
+        with tracing.span("llm", site=site, model=model_name) as span:
+            prompt_value = prompt.invoke(inputs)
+            prompt_text = prompt_value.to_string()
+            key = _prompt_key(store, model, prompt_text)
+            response = store.get(key, site, ttl)
+            if response is not None:
+                span.record(cache_hits=1)
+                return response
+
+            # Misses go through the shared scheduler so they respect the rate
+            # limits. The model's own message is kept for its usage metadata.
+            message = get_scheduler().run(
+                lambda: model.invoke(prompt_value),
+                model_name, prompt_text,
+                expected_output_tokens=getattr(model, "max_tokens", None),
+            )
+            response = parser.invoke(message)
+            store.put(key, site, response)
+            span.record(cache_misses=1, http_calls=1, **token_counts(prompt_text, response, message_usage(message)))
+            return response
+
+    return RunnableLambda(run)
+
+
+def cached_stream(prompt, model, site, inputs, ttl=None, cache=None):
+    # Streaming counterpart of cached_chain: a hit is yielded whole, a miss token by token
+    ttl = TTLS.get(site, DEFAULT_TTL) if ttl is None else ttl
+    store = cache or get_cache()
+    model_name = model_signature(model)[0]
+    # A generator can't keep a span current across yields, so it is closed explicitly
+    tracer = tracing.get_tracer()
+    span = tracer.start_span("llm", site=site, model=model_name, stream=True)
+    error = None
+    try:
+        prompt_value = prompt.invoke(inputs)
+        prompt_text = prompt_value.to_string()
+        key = _prompt_key(store, model, prompt_text)
+        response = store.get(key, site, ttl)
+        if response is not None:
+            span.record(cache_hits=1)
+            yield response
+            return
+
+        chunks = []
+        usage = None
+
+        def generate():
+            # Providers that report usage while streaming attach it to the chunks
+            nonlocal usage
+            for message in model.stream(prompt_value):
+                chunk_usage = message_usage(message)
+                if chunk_usage is not None:
+                    usage = tuple(a + b for a, b in zip(usage or (0, 0), chunk_usage))
+                yield message if isinstance(message, str) else message.content
+
+        for chunk in get_scheduler().stream(
+            generate, model_name, prompt_text,
+            expected_output_tokens=getattr(model, "max_tokens", None),
+        ):
+            chunks.append(chunk)
+            yield chunk
+        response = "".join(chunks)
+        store.put(key, site, response)
+        span.record(cache_misses=1, http_calls=1, **token_counts(prompt_text, response, usage))
+    except GeneratorExit:
+        # The consumer stopped reading early; not an error
+        raise
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        tracer.end_span(span, error)
@@ -0,0 +1,274 @@
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from financialdata import CACHE_DIR
+
+INTERACTIVE = 0
+BATCH = 1
+
+# Priority for requests made in the current context; see request_priority()
+_priority = contextvars.ContextVar("valuategpt_priority", default=None)
+
+# Requests and tokens per minute for each model. Models without an entry are
+# not throttled. Override with configure() or VALUATEGPT_RATE_LIMITS (JSON).
+DEFAULT_LIMITS = {
+    "gpt-4": {"rpm": 500, "tpm": 10000},
+    "gpt-4o": {"rpm": 500, "tpm": 30000},
+    "gpt-3.5-turbo-instruct": {"rpm": 3500, "tpm": 90000},
+    "text-embedding-ada-002": {"rpm": 3000, "tpm": 1000000},
+}
+DEFAULT_OUTPUT_TOKENS = 512
+WINDOW = 60.0
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    # Loaded on first use: tiktoken may need to download its BPE file, which
+    # must not happen (or fail) at import time on an offline machine
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                _encoding = None
+            _encoding_loaded = True
+        return _encoding
+
+
+def estimate_tokens(text):
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # Rough 4-characters-per-token estimate
+    return len(text) // 4
+
+
+def is_rate_limit_error(error):
+    if type(error).__name__ == "RateLimitError":
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429
+
+
+def _within_limits(limits, requests, used_tokens, tokens):
+    if not limits:
+        return True
+    if limits.get("rpm") and requests >= limits["rpm"]:
+        return False
+    # A request bigger than the whole budget still runs once the window is empty
+    if limits.get("tpm") and used_tokens + tokens > limits["tpm"] and requests:
+        return False
+    return True
+
+
+class UsageWindow:
+    # Requests admitted in the last WINDOW seconds, per model. Kept in SQLite so
+    # every process sharing the cache directory (the Streamlit app, batch.py)
+    # draws from one budget instead of each assuming it has the whole quota.
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "rate_limits.sqlite3")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS usage (model TEXT NOT NULL, at REAL NOT NULL, tokens INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS usage_model_at ON usage (model, at)")
+
+    def _select(self, model, now):
+        return self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(tokens), 0), MIN(at) FROM usage WHERE model = ? AND at > ?",
+            (model, now - WINDOW),
+        ).fetchone()
+
+    def admit(self, model, tokens, limits):
+        # Checks the budget and records the request in one write transaction, so
+        # two processes can't both take the last slot. Returns None once admitted,
+        # otherwise how long to wait before the oldest request leaves the window.
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM usage WHERE model = ? AND at <= ?", (model, now - WINDOW))
+                requests, used_tokens, oldest = self._select(model, now)
+                admitted = _within_limits(limits, requests, used_tokens, tokens)
+                if admitted:
+                    self._conn.execute("INSERT INTO usage (model, at, tokens) VALUES (?, ?, ?)", (model, now, tokens))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if admitted:
+            return None
+        return WINDOW - (now - oldest) if oldest is not None else 1.0
+
+    def usage(self):
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT model, COUNT(*), SUM(tokens) FROM usage WHERE at > ? GROUP BY model", (now - WINDOW,)
+            ).fetchall()
+        return {model: (requests, tokens) for model, requests, tokens in rows}
+
+
+class LLMScheduler:
+    # Admission is shared across processes through the UsageWindow; the
+    # priority queue is per process, so batch processes should also lower their
+    # default priority (see set_default_priority).
+    def __init__(self, limits=None, max_retries=6, base_delay=1.0, max_delay=60.0, window=None):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(json.loads(os.environ.get("VALUATEGPT_RATE_LIMITS", "{}")))
+        self.limits.update(limits or {})
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.default_priority = INTERACTIVE
+        self.counters = Counter()
+        self._cond = threading.Condition()
+        self._queues = defaultdict(list)
+        self._window = window or UsageWindow()
+        self._sequence = itertools.count()
+
+    def configure(self, model, rpm=None, tpm=None):
+        with self._cond:
+            self.limits[model] = {"rpm": rpm, "tpm": tpm}
+            self._cond.notify_all()
+
+    def _count(self, name):
+        with self._cond:
+            self.counters[name] += 1
+
+    def _acquire(self, model, tokens, priority):
+        entry = (priority, next(self._sequence))
+        started = time.monotonic()
+        throttled = False
+        with self._cond:
+            queue = self._queues[model]
+            heapq.heappush(queue, entry)
+            # Requests for one model are admitted in priority order, FIFO within a
+            # priority. Other processes don't notify us, so waits are bounded by
+            # when the window frees up.
+            while True:
+                timeout = 1.0
+                if queue[0] == entry:
+                    timeout = self._window.admit(model, tokens, self.limits.get(model))
+                    if timeout is None:
+                        break
+                throttled = True
+                self._cond.wait(timeout=max(timeout, 0.05))
+            heapq.heappop(queue)
+            self.counters["admitted"] += 1
+            self.counters["throttled"] += throttled
+            self.counters["wait_ms"] += int((time.monotonic() - started) * 1000)
+            self._cond.notify_all()
+
+    def _backoff(self, attempt):
+        # Full jitter: a random delay up to the capped exponential bound
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        self._count("retries")
+        time.sleep(random.uniform(0, delay))
+
+    def _priority(self, priority):
+        # An explicit priority wins, then the context's, then the process default
+        if priority is None:
+            priority = _priority.get()
+        return self.default_priority if priority is None else priority
+
+    def _request_tokens(self, prompt_text, expected_output_tokens):
+        if expected_output_tokens is None:
+            expected_output_tokens = DEFAULT_OUTPUT_TOKENS
+        return estimate_tokens(prompt_text) + expected_output_tokens
+
+    def run(self, call, model, prompt_text, priority=None, expected_output_tokens=None):
+        tokens = self._request_tokens(prompt_text, expected_output_tokens)
+        priority = self._priority(priority)
+        for attempt in range(self.max_retries + 1):
+            self._acquire(model, tokens, priority)
+            try:
+                return call()
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    self._count("failed")
+                    raise
+                self._count("rate_limited")
+                self._backoff(attempt)
+
+    def stream(self, call, model, prompt_text, priority=None, expected_output_tokens=None):
+        # Like run() for a generator; retries only if nothing has been yielded yet
+        tokens = self._request_tokens(prompt_text, expected_output_tokens)
+        priority = self._priority(priority)
+        for attempt in range(self.max_retries + 1):
+            self._acquire(model, tokens, priority)
+            started = False
+            try:
+                for chunk in call():
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or not is_rate_limit_error(e) or attempt == self.max_retries:
+                    self._count("failed")
+                    raise
+                self._count("rate_limited")
+                self._backoff(attempt)
+
+    def metrics(self):
+        # requests_last_minute and tokens_last_minute cover every process
+        # sharing the window; queue depths are this process's
+        usage = self._window.usage()
+        with self._cond:
+            models = {}
+            for model in set(self._queues) | set(usage):
+                requests, tokens = usage.get(model, (0, 0))
+                models[model] = {
+                    "queue_depth": len(self._queues[model]),
+                    "requests_last_minute": requests,
+                    "tokens_last_minute": tokens,
+                }
+            return {
+                "queue_depth": sum(len(queue) for queue in self._queues.values()),
+                "models": models,
+                **self.counters,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    # One scheduler per process so every chain draws from the same budgets; the
+    # budgets themselves are shared with other processes through UsageWindow
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
+
+
+def set_default_priority(priority):
+    # Batch processes lower their priority so interactive requests go first
+    get_scheduler().default_priority = priority
+
+
+@contextmanager
+def request_priority(priority):
+    # Requests made inside the block, including from worker threads started via
+    # tracing.propagate, queue at this priority; e.g. prewarm jobs sharing a
+    # process with interactive ones
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
@@ -1,25 +1,50 @@
-import fitz  # PyMuPDF
-from tqdm.auto import tqdm
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from langchain.llms import OpenAI
 from langchain.embeddings import OpenAIEmbeddings
 from langchain.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.schema import Document
 from langchain.prompts import ChatPromptTemplate
-from langchain.schema.output_parser import StrOutputParser
-from langchain.chains import RetrievalQA
 from langchain.chat_models import ChatOpenAI
+from pdfingest import corpus_paths, format_text, iter_documents
+from indexstore import latest_index_key, load_index, save_index, source_key
+from hybridretrieval import retriever_for
+from embeddingstore import EmbeddingStore, chunk_hash
+from llmcache import cached_chain
+import tracing
 
 class MacroeconomicAnalyzer:
-    def __init__(self, pdf_path, company, openai_api_key):
+    chunk_size = 1000
+    chunk_overlap = 200
+    top_k = 4
+    retrieval_modes = ("concurrent", "consolidated", "hybrid")
+
+    def __init__(self, pdf_path, company, openai_api_key, retrieval_mode="concurrent", max_concurrency=4, vectorstore=None, ingest_workers=None, llm=None, embeddings=None, embedding_store=None):
+        if retrieval_mode not in self.retrieval_modes:
+            raise ValueError(f"retrieval_mode must be one of {self.retrieval_modes}, got {retrieval_mode!r}")
+        # pdf_path is a single PDF or a directory of macro reports
         self.pdf_path = pdf_path
+        self.pdf_paths = corpus_paths(pdf_path)
+        self.ingest_workers = ingest_workers
         self.company = company
         self.openai_api_key = openai_api_key
+        # "concurrent" answers each question in parallel; "consolidated" skips the
+        # per-question calls and hands all retrieved excerpts to generate_analysis;
+        # "hybrid" answers in parallel from BM25 + FAISS results, reranked and trimmed
+        self.retrieval_mode = retrieval_mode
+        self.max_concurrency = max_concurrency
         self.documents = []
         self.splits = []
-        self.vectorstore = None
-        self.retriever = None
-        self.llm = ChatOpenAI(
+        # A vectorstore passed in (e.g. shared across a batch run) skips loading entirely
+        self.vectorstore = vectorstore
+        self.retriever = vectorstore.as_retriever() if vectorstore is not None else None
+        self.index_key = None
+        # Clients passed in (e.g. by a ReportPipeline) are reused instead of built per analyzer
+        self.embeddings = embeddings or OpenAIEmbeddings(openai_api_key=self.openai_api_key)
+        self.embedding_store = embedding_store or EmbeddingStore(self.embeddings)
+        self.llm = llm or ChatOpenAI(
             model_name="gpt-4",
             temperature=0,
             openai_api_key=self.openai_api_key
@@ -27,70 +52,142 @@ class MacroeconomicAnalyzer:
 
     @staticmethod
     def text_formatter(text):
-        return text.replace('\n', ' ').strip()
+        return format_text(text)
 
     def read_pdf(self):
-        doc = fitz.open(self.pdf_path)
-        pages_and_texts = []
-        for page_number, page in tqdm(enumerate(doc), total=doc.page_count, desc="Reading PDF"):
-            text = page.get_text()
-            text = self.text_formatter(text)
-            pages_and_texts.append({
-                "page_number": page_number + 1,
-                "page_char_count": len(text),
-                "page_word_count": len(text.split(" ")),
-                "page_sentence_count": len(text.split(". ")),
-                "page_token_count": len(text) // 4,
-                "text": text
-            })
-        return pages_and_texts
+        # Pages of every PDF in the corpus, extracted in a process pool and streamed in order
+        return iter_documents(self.pdf_paths, workers=self.ingest_workers)
 
     def create_documents(self):
-        data = self.read_pdf()
-        for page in data:
-            text = page['text'].strip()
-            if text:
-                doc = Document(
-                    page_content=text,
-                    metadata={
-                        'page_number': page['page_number'],
-                        'char_count': page['page_char_count'],
-                    }
-                )
-                self.documents.append(doc)
+        self.documents = self.read_pdf()
 
     def split_text(self):
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        self.splits = text_splitter.split_documents(self.documents)
+        # Pages are split as they stream in, so only the chunks are kept in memory
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+        self.splits = []
+        for doc in self.documents:
+            self.splits.extend(text_splitter.split_documents([doc]))
+        self.documents = []
+
+    def get_index_key(self):
+        if self.index_key is None:
+            self.index_key = source_key(
+                self.pdf_paths,
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                embedding_model=getattr(self.embeddings, "model", ""),
+            )
+        return self.index_key
+
+    def load_vectorstore(self):
+        # The index is keyed by the corpus bytes and splitter settings, so a hit is always current
+        with tracing.span("macro.index_load") as span:
+            self.vectorstore = load_index(self.get_index_key(), self.embeddings)
+            span.record(cache_hits=int(self.vectorstore is not None), cache_misses=int(self.vectorstore is None))
+        if self.vectorstore is not None:
+            self.retriever = self.vectorstore.as_retriever()
+        return self.vectorstore is not None
+
+    @staticmethod
+    def document_id(doc):
+        # Docstore ids cover text and metadata, so a chunk that only moved pages is
+        # swapped in the index while its embedding still comes from the store
+        return chunk_hash(doc.page_content + json.dumps(doc.metadata, sort_keys=True))
 
     def build_vectorstore(self):
         # print("Starting vector store...")
-        embeddings = OpenAIEmbeddings(openai_api_key=self.openai_api_key)
-        self.vectorstore = FAISS.from_documents(self.splits, embeddings)
+        chunks = {self.document_id(doc): doc for doc in self.splits}
+        if not chunks:
+            raise ValueError(f"no text could be extracted from {self.pdf_path}")
+
+        # Start from the previous index of this source when there is one and only
+        # remove or add the chunks that changed
+        previous_key = latest_index_key(self.pdf_path)
+        vectorstore = load_index(previous_key, self.embeddings, mmap=False) if previous_key else None
+        if vectorstore is not None:
+            existing = set(vectorstore.index_to_docstore_id.values())
+            stale = [doc_id for doc_id in existing if doc_id not in chunks]
+            if stale:
+                vectorstore.delete(stale)
+            new_ids = [doc_id for doc_id in chunks if doc_id not in existing]
+        else:
+            new_ids = list(chunks)
+
+        if new_ids:
+            texts = [chunks[doc_id].page_content for doc_id in new_ids]
+            vectors = self.embedding_store.embed(texts)
+            metadatas = [chunks[doc_id].metadata for doc_id in new_ids]
+            if vectorstore is None:
+                vectorstore = FAISS.from_embeddings(list(zip(texts, vectors)), self.embeddings, metadatas=metadatas, ids=new_ids)
+            else:
+                vectorstore.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=new_ids)
+
+        self.vectorstore = vectorstore
         self.retriever = self.vectorstore.as_retriever()
+        save_index(self.vectorstore, self.get_index_key(), {"source": self.pdf_path, "files": [os.path.basename(path) for path in self.pdf_paths]})
         # print("Vector store built.")
 
     def generate_questions(self):
         prompt_to_retrieve = ChatPromptTemplate.from_messages([('system', "You're the world's most renowned financial analyst, celebrated for your uncanny ability to decipher complex economic data and predict market trends with remarkable precision. One day, while perusing the latest Economic Survey, you notice subtle patterns and anomalies that others have overlooked. Embedded within the dense charts and statistics are hidden insights into the key economic factors affecting the growth of companies in various sectors. Global economic shifts, fiscal policies, consumer spending behaviors, inflation rates, technological advancements, and international trade dynamics—all these elements are interwoven in the data before you. You realize that by extracting and analyzing these factors, you could forecast which companies are poised for extraordinary growth and which might face impending decline. Time is of the essence. Investors, corporations, and even governments are making decisions without the critical insights you've uncovered. You decide to delve deep into the Economic Survey to extract these vital economic factors. Your goal is to construct a comprehensive analysis that can guide businesses and investors toward informed, strategic decisions that foster sustainable growth. Armed with your expertise, you set out on this mission to unlock insights about {company} and you have decided to ask 10 questions and get the data from economic analysis of the country to get the information you need, therefore it will be better to ask industry wide questions rather than asking company specific, otherwise you know better. List those 10 questions only , in para form separated by ********, no other information is needed.")])
 
-        chain = prompt_to_retrieve | self.llm | StrOutputParser()
+        chain = cached_chain(prompt_to_retrieve, self.llm, "macro.questions")
         questions_str = chain.invoke({"company": self.company})
         questions = questions_str.split("********")
         self.questions = [q.strip() for q in questions if q.strip()]
         # print(self.questions)
 
+    def search_questions(self):
+        # Embed every question in one request and search the index once for the batch
+        if not self.questions:
+            return []
+        with tracing.span("macro.search", questions=len(self.questions)) as span:
+            # Through the embedding store, so the request is cached, goes through the
+            # LLM scheduler and records its http_calls and tokens_in_est
+            vectors = np.asarray(self.embedding_store.embed(self.questions), dtype=np.float32)
+            if self.retrieval_mode == "hybrid":
+                results = retriever_for(self.vectorstore).search(self.questions, vectors)
+                span.record(chunks=sum(len(docs) for docs in results))
+                return results
+            _, indices = self.vectorstore.index.search(vectors, self.top_k)
+        results = []
+        for row in indices:
+            docs = []
+            for i in row:
+                if i == -1:
+                    continue
+                doc_id = self.vectorstore.index_to_docstore_id[int(i)]
+                docs.append((doc_id, self.vectorstore.docstore.search(doc_id)))
+            results.append(docs)
+        return results
+
+    def answer_question(self, question, docs):
+        prompt = ChatPromptTemplate.from_messages([
+            ('system', "Use the following pieces of context to answer the user's question. If you don't know the answer, just say that you don't know, don't try to make up an answer.\n----------------\n{context}"),
+            ('human', "{question}")
+        ])
+        chain = cached_chain(prompt, self.llm, "macro.answer")
+        context = "\n\n".join(doc.page_content for _, doc in docs)
+        return chain.invoke({"context": context, "question": question})
+
     def retrieve_context(self):
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=self.llm,
-            chain_type="stuff",
-            retriever=self.retriever
-        )
+        retrieved = self.search_questions()
 
-        context = ""
-        for question in self.questions:
-            context += question + "\n\n"
-            answer = qa_chain.run(question)
-            context += answer + "\n\n"
+        if self.retrieval_mode == "consolidated":
+            # One deduplicated set of excerpts for a single synthesis call
+            unique_docs = {}
+            for docs in retrieved:
+                for doc_id, doc in docs:
+                    unique_docs.setdefault(doc_id, doc)
+            context = "Questions:\n" + "\n".join(self.questions) + "\n\n"
+            context += "Excerpts from the economic survey:\n\n"
+            context += "\n\n".join(doc.page_content for doc in unique_docs.values())
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                answers = list(executor.map(tracing.propagate(self.answer_question), self.questions, retrieved))
+            context = ""
+            for question, answer in zip(self.questions, answers):
+                context += question + "\n\n"
+                context += answer + "\n\n"
         self.context = context
         print(self.context)
 
@@ -102,15 +199,23 @@ class MacroeconomicAnalyzer:
             """)
         ])
 
-        chain = prompt_context | self.llm | StrOutputParser()
+        chain = cached_chain(prompt_context, self.llm, "macro.analysis")
         self.analysis = chain.invoke({"company": self.company, "context": self.context})
 
+    def prepare_vectorstore(self):
+        # Only ingest the corpus when no index exists for its current contents
+        if self.vectorstore is None and not self.load_vectorstore():
+            with tracing.span("macro.ingest", source=self.pdf_path, files=len(self.pdf_paths)):
+                self.create_documents()
+                # print("Splitting text...")
+                self.split_text()
+            # print("Building vector store...")
+            with tracing.span("macro.index_build", chunks=len(self.splits)):
+                self.build_vectorstore()
+        return self.vectorstore
+
     def analyze(self):
-        self.create_documents()
-        # print("Splitting text...")
-        self.split_text()
-        # print("Building vector store...")
-        self.build_vectorstore()
+        self.prepare_vectorstore()
         # print("Generating questions...")
         self.generate_questions()
         # print("Retrieving context...")
@@ -1,88 +1,89 @@
+import time
 import streamlit as st
-from industrypeer import IndustryPeerAnalysis
-from macroanalysis import MacroeconomicAnalyzer
-from newsanalyst import NewsAnalyzer
-from technicalanalyst import TechnicalAnalysisAnalyzer
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from langchain.llms import OpenAI
+import pandas as pd
+from pipeline import STAGE_NAMES
+from reportqueue import ReportService, popular_tickers
+
+# Seconds between checks on a running report
+POLL_INTERVAL = 1.0
+
+@st.cache_resource
+def get_report_service():
+    # One worker pool, report store and set of loaded clients and indexes shared by every session
+    return ReportService().start(prewarm_tickers=popular_tickers())
+
+service = get_report_service()
 
 # Set the title of the Streamlit app
 st.title("ValuateGPT: Financial Analysis and Investment Recommendations")
 st.write("Enter a company name or stock symbol to get comprehensive financial insights, industry comparisons, macroeconomic analysis, and expert investment recommendations from ValuateGPT.")
 
 # Input for company name or stock symbol
-company_name = st.text_input("Company Name", placeholder="e.g., AAPL, TCS, Google")
-openai_api_key = st.text_input("Enter your OpenAI API key", type="password")
-
-# Define the function to run all analyses
-def run_analysis(company):
-    
-
-    # Industry Peer Analysis
-    Industry = IndustryPeerAnalysis(company, openai_api_key)
-    Industry.analyze()
-    IndustryResults = Industry.get_result()
+company_name = st.text_input("Company Name", placeholder="e.g., AAPL, TCS, Google", key="company_name")
+openai_api_key = st.text_input("Enter your OpenAI API key", type="password", key="openai_api_key")
 
-    # Macroeconomic Analysis
-    pdf_path = "financialanalyst/US_Economic_Forecast_Deloitte.pdf"
-    macroanalyzer = MacroeconomicAnalyzer(pdf_path, company, openai_api_key)
-    macroanalyzer.analyze()
-    macro_analysis_result = macroanalyzer.get_analysis()
-
-    # News Analysis
-    news_analyzer = NewsAnalyzer(openai_api_key)
-    news_result = news_analyzer.analyze_news(company)
-
-    # Technical Analysis
-    ta_analyzer = TechnicalAnalysisAnalyzer(openai_api_key)
-    ta_analysis_result = ta_analyzer.analyze_technical_data(company)
+def render_section(name, result):
+    st.markdown(f"#### {name}")
+    if isinstance(result, dict):
+        # The peer stage returns ratios per company, which read best as a table
+        st.dataframe(pd.DataFrame(result))
+    else:
+        st.write(result)
 
-    # Combine all analysis results
-    combined_analysis = f"""
-    Industry Analysis:
-    {IndustryResults}
+def render_report(report):
+    st.subheader(f"Financial Insights for {report['company']}")
+    for name in STAGE_NAMES:
+        if name in report["sections"]:
+            render_section(name, report["sections"][name])
+    st.markdown("#### Investment Recommendation")
+    st.write(report["recommendation"])
+    if "age" in report:
+        st.caption(f"Generated {int(report['age'] // 60)} minutes ago")
 
-    Macroeconomic Analysis:
-    {macro_analysis_result}
+def start_analysis():
+    company = st.session_state.company_name.strip()
+    st.session_state.pop("job_error", None)
+    if not company:
+        st.session_state.job_error = "Please enter a company name to proceed."
+        return
+    # A fresh stored report is shown at once; otherwise the request joins the queue,
+    # sharing a job with anyone else already waiting on the same ticker
+    report = service.cached_report(company)
+    if report is not None:
+        st.session_state.report = report
+        return
+    st.session_state.pop("report", None)
+    st.session_state.job_id = service.submit(company, st.session_state.openai_api_key)
 
-    News Analysis:
-    {news_result}
+job_id = st.session_state.get("job_id")
 
-    Technical Analysis:
-    {ta_analysis_result}
-    """
-    
-    # Create the Langchain prompt
-    prompt = PromptTemplate(
-        input_variables=["combined_analysis"],
-        template="""
-        You are a financial analyst with expertise in stock market analysis. Based on the following combined analysis of the company, provide a detailed investment recommendation:
-        
-        {combined_analysis}
-        
-        Output should include:
-        - A summary of the investment outlook considering the factors mentioned above.
-        - Clear and specific investment strategy for short-term traders, long-term investors, and current holders.
-        - Any risks or opportunities identified for the stock.
-        - Be as specific as possible, including potential price targets, trends to watch, and any cautionary advice for investors.
-        """
-    )
+# The button stays disabled while a report is running so it can't be resubmitted
+st.button("Get Company Info", on_click=start_analysis, disabled=job_id is not None)
 
-    # Set up Langchain LLM with OpenAI API
-    llm = OpenAI(openai_api_key=openai_api_key)
-    chain = LLMChain(llm=llm, prompt=prompt)
+if "job_error" in st.session_state:
+    st.warning(st.session_state.job_error)
 
-    # Run the Langchain analysis and return the result
-    final_recommendation = chain.run({"combined_analysis": combined_analysis})
-    return final_recommendation
+if job_id is not None:
+    # The job runs on a worker thread; each script run draws what it has stored so far
+    job = service.store.job(job_id)
+    st.subheader(f"Financial Insights for {job['company']}")
+    for name in STAGE_NAMES:
+        if name in job["sections"]:
+            render_section(name, job["sections"][name])
+        else:
+            st.info(f"{name}: fetching information...")
+    st.markdown("#### Investment Recommendation")
+    if job["recommendation"]:
+        st.write(job["recommendation"])
 
-# Display the result when the button is clicked
-if st.button("Get Company Info"):
-    if company_name.strip():
-        with st.spinner("Fetching information..."):
-            result = run_analysis(company_name)
-        st.subheader(f"Financial Insights for {company_name}")
-        st.write(result)
+    if job["status"] == "done":
+        st.session_state.report = service.cached_report(job["company"]) or job
+        del st.session_state.job_id
+    elif job["status"] == "error":
+        st.session_state.job_error = f"Report failed: {job['error']}"
+        del st.session_state.job_id
     else:
-        st.warning("Please enter a company name to proceed.")
+        time.sleep(POLL_INTERVAL)
+    st.rerun()
+elif "report" in st.session_state:
+    render_report(st.session_state.report)
@@ -1,44 +1,156 @@
 import json
+import random
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
 from langchain.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
-from langchain.schema.output_parser import StrOutputParser
+from llmcache import cached_chain
+from llmscheduler import estimate_tokens
+import tracing
 import newselenium
 
+# Universal hash family (a*x + b) mod p for MinHash signatures; fixed seed so
+# signatures are stable across runs. a and b span the whole field so every hash
+# wraps mod p and orders shingles differently; Python ints avoid uint64 overflow.
+MINHASH_PERMUTATIONS = 64
+_MINHASH_PRIME = (1 << 61) - 1
+_rng = random.Random(7)
+_MINHASH_PARAMS = [(_rng.randrange(1, _MINHASH_PRIME), _rng.randrange(1, _MINHASH_PRIME)) for _ in range(MINHASH_PERMUTATIONS)]
+
+DATE_FIELDS = ("published", "publishedAt", "published_at", "date")
+
+
+def shingles(text: str, k: int = 5):
+    words = re.findall(r"\w+", text.lower())
+    return {zlib.crc32(" ".join(words[i:i + k]).encode()) for i in range(max(len(words) - k + 1, 1))}
+
+
+def minhash_signature(text: str):
+    values = shingles(text)
+    return tuple(min((a * x + b) % _MINHASH_PRIME for x in values) for a, b in _MINHASH_PARAMS)
+
+
+def signature_similarity(signature, other):
+    # Fraction of matching minimums estimates the Jaccard similarity of the shingle sets
+    return sum(x == y for x, y in zip(signature, other)) / len(signature)
+
+
+def deduplicate_articles(articles, threshold: float = 0.8):
+    # Drop near-identical copies (e.g. syndicated wire stories), keeping the first seen
+    kept, signatures = [], []
+    for article in articles:
+        signature = minhash_signature(article["content"])
+        if any(signature_similarity(signature, other) >= threshold for other in signatures):
+            continue
+        kept.append(article)
+        signatures.append(signature)
+    return kept
+
+
+def _parse_date(article):
+    for field in DATE_FIELDS:
+        value = article.get(field)
+        if not value:
+            continue
+        try:
+            published = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            continue
+        return published if published.tzinfo else published.replace(tzinfo=timezone.utc)
+    return None
+
+
+def rank_articles(articles, keyword: str, half_life_days: float = 3.0):
+    # Score = keyword relevance x recency decay; undated articles get a neutral recency
+    terms = [t for t in re.findall(r"\w+", keyword.lower()) if t]
+    now = datetime.now(timezone.utc)
+
+    def score(article):
+        text = (article.get("title") or "") + " " + article["content"]
+        words = re.findall(r"\w+", text.lower())
+        mentions = sum(words.count(t) for t in terms)
+        relevance = np.log1p(mentions) + 1.0
+        published = _parse_date(article)
+        if published is None:
+            recency = 0.5
+        else:
+            age_days = max((now - published).total_seconds() / 86400, 0.0)
+            recency = 0.5 ** (age_days / half_life_days)
+        return relevance * recency
+
+    return sorted(articles, key=score, reverse=True)
+
+
+def pack_chunks(articles, token_budget: int, chunk_tokens: int):
+    # Fill chunks of at most chunk_tokens in rank order until the overall budget runs out
+    chunks, current, current_tokens, used = [], [], 0, 0
+    for article in articles:
+        text = article["content"][:chunk_tokens * 4]
+        tokens = estimate_tokens(text)
+        if used + tokens > token_budget:
+            break
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+        used += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
 class NewsAnalyzer:
-    def __init__(self, openai_api_key: str, model_name: str = "gpt-4o"):
-        self.model = ChatOpenAI(openai_api_key=openai_api_key, model=model_name)
+    def __init__(self, openai_api_key: str, model_name: str = "gpt-4o", token_budget: int = 12000, chunk_tokens: int = 3000, max_concurrency: int = 4, model: ChatOpenAI = None):
+        self.model = model or ChatOpenAI(openai_api_key=openai_api_key, model=model_name)
+        self.token_budget = token_budget
+        self.chunk_tokens = chunk_tokens
+        self.max_concurrency = max_concurrency
         
         self.news_analyze_prompt = ChatPromptTemplate.from_messages([
             ("system", "You're the best News trader in the world. You have a secret source that gives you the most accurate news before it happens. You've been using this source to make millions of dollars in the stock market. One day, you receive a message from your source that says: The world is about to end. You have to warn everyone. You're not sure if you should believe it, but you decide to investigate. You start by checking the news and see that there have been a series of strange events happening around the world. You realize that your source was right. The world is about to end. You have to warn everyone before it's too late. You decide to use your trading skills to make as much money as possible before the world ends. You have to act fast. You have to save as many people as you can. You have to be the hero the world needs. You have to be the News Trader."),
-            ("human", "You come across news articles of {company} \n the news is {news} \n You have to give your insights on this news. What do you think will happen to the stock price of {company} after this news? Will it go up or down? Why? What should people do with their investments in {company}?")
+            ("human", "You come across news articles of {company} \n the news is {news} \n You have to give your insights on this news. What do you think will happen to the stock price of {company} after this news? Will it go up or down? Why? What should people do with their investments in {company}? Write the answer with a system essence: no LLM talking, explain the info only.")
         ])
 
-        self.output_prompt = ChatPromptTemplate.from_messages([
-            ('system', 'Give this content a system essence, remove all the LLMs talking, and explain the info only \n {response}')
+        self.chunk_prompt = ChatPromptTemplate.from_messages([
+            ("system", "You summarize financial news for a trader. Keep every fact, figure, date and named entity that could move the stock price of {company}. Drop boilerplate and anything unrelated to {company}."),
+            ("human", "Summarize these news articles about {company}:\n{news}")
         ])
 
-    def extract_content_from_json_file(self, file_path: str):
-        extracted_contents = []
+    def load_articles(self, file_path: str):
         with open(file_path, 'r', encoding='utf-8') as file:
             data = json.load(file)
-            for article in data:
-                if 'content' in article and article['content'] is not None:
-                    extracted_contents.append(article['content'])
-        return extracted_contents
+        return [article for article in data if article.get('content')]
+
+    def summarize_chunk(self, keyword: str, chunk: str):
+        chain = cached_chain(self.chunk_prompt, self.model, "news.chunk_summary")
+        return chain.invoke({"company": keyword, "news": chunk})
 
     def analyze_news(self, keyword: str):
-        news_extractor = newselenium.NewsExtractor(keyword)
-        news_extractor.fetch_articles()
-        news_extractor.save_to_json(f"{keyword}_news.json")
+        with tracing.span("news.scrape", company=keyword) as span:
+            span.record(http_calls=1)
+            news_extractor = newselenium.NewsExtractor(keyword)
+            news_extractor.fetch_articles()
+            news_extractor.save_to_json(f"{keyword}_news.json")
         
         json_file_path = f"{keyword}_news.json"
-        news_contents = self.extract_content_from_json_file(json_file_path)
-        news_articles = " ".join(news_contents)
-        
-        chain = self.news_analyze_prompt | self.model | StrOutputParser()
-        chain2 = self.output_prompt | self.model | StrOutputParser()
-        
-        response = chain.invoke({"company": keyword, "news": news_articles})
-        final_response = chain2.invoke({"response": response})
+        articles = rank_articles(self.load_articles(json_file_path), keyword)
+        articles = deduplicate_articles(articles)
+        chunks = pack_chunks(articles, self.token_budget, self.chunk_tokens)
+
+        # Map: summarize chunks concurrently, unless everything already fits in one
+        if len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                summaries = list(executor.map(tracing.propagate(lambda chunk: self.summarize_chunk(keyword, chunk)), chunks))
+            news = "\n\n".join(summaries)
+        else:
+            news = "".join(chunks)
+
+        # Reduce: a single call that already returns the cleaned-up analysis
+        chain = cached_chain(self.news_analyze_prompt, self.model, "news.analysis")
+        final_response = chain.invoke({"company": keyword, "news": news})
         
         return final_response
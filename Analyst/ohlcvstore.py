@@ -0,0 +1,92 @@
+import os
+import time
+import pandas as pd
+import yfinance as yf
+from financialdata import CACHE_DIR
+import tracing
+
+OHLCV_DIR = os.path.join(CACHE_DIR, "ohlcv")
+FIELDS = ("Open", "High", "Low", "Close", "Volume")
+
+
+class OHLCVStore:
+    # One Parquet file of bars per ticker; refreshes download only the bars after the last stored one
+    def __init__(self, root=None, interval="1wk", history="1y", refresh_after=3600, offline=None):
+        self.root = root or OHLCV_DIR
+        os.makedirs(self.root, exist_ok=True)
+        self.interval = interval
+        self.history = history
+        self.refresh_after = refresh_after
+        if offline is None:
+            offline = os.environ.get("VALUATEGPT_OFFLINE") == "1"
+        self.offline = offline
+
+    def _path(self, ticker):
+        name = ticker.upper().replace(os.sep, "_")
+        return os.path.join(self.root, f"{name}.{self.interval}.parquet")
+
+    def load(self, ticker):
+        path = self._path(ticker)
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=list(FIELDS))
+        return pd.read_parquet(path)
+
+    def _save(self, ticker, frame):
+        path = self._path(ticker)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        frame.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+
+    def _is_stale(self, ticker):
+        path = self._path(ticker)
+        return not os.path.exists(path) or time.time() - os.path.getmtime(path) > self.refresh_after
+
+    @staticmethod
+    def _ticker_frame(data, ticker, single):
+        if isinstance(data.columns, pd.MultiIndex):
+            if ticker not in data.columns.get_level_values(0):
+                return pd.DataFrame()
+            frame = data[ticker]
+        elif single:
+            frame = data
+        else:
+            return pd.DataFrame()
+        frame = frame[[field for field in FIELDS if field in frame.columns]]
+        return frame.dropna(how="all")
+
+    def update(self, tickers):
+        # yf.download upper-cases symbols, so stored bars are keyed the same way
+        tickers = list(dict.fromkeys(t.upper() for t in tickers))
+        stale = [] if self.offline else [t for t in tickers if self._is_stale(t)]
+        if not stale:
+            return
+
+        existing = {t: self.load(t) for t in stale}
+        # Re-fetch from the last stored bar, which may still have been forming when it was saved
+        if any(frame.empty for frame in existing.values()):
+            window = {"period": self.history}
+        else:
+            window = {"start": min(frame.index[-1] for frame in existing.values())}
+
+        # One batched request for every ticker that needs new bars
+        with tracing.span("ohlcv.download", tickers=len(stale)) as span:
+            span.record(http_calls=1)
+            data = yf.download(stale, interval=self.interval, group_by="ticker", progress=False, threads=True, **window)
+        if data.empty:
+            return
+
+        for ticker in stale:
+            new_bars = self._ticker_frame(data, ticker, single=len(stale) == 1)
+            if new_bars.empty:
+                continue
+            combined = pd.concat([existing[ticker], new_bars]) if not existing[ticker].empty else new_bars
+            combined = combined[~combined.index.duplicated(keep="last")].sort_index()
+            self._save(ticker, combined)
+
+    def closes(self, tickers):
+        # Closing prices aligned on date, one column per ticker
+        frames = {t: self.load(t)["Close"] for t in dict.fromkeys(t.upper() for t in tickers)}
+        frames = {t: close for t, close in frames.items() if not close.empty}
+        if not frames:
+            return pd.DataFrame()
+        return pd.DataFrame(frames).sort_index().astype("float64")
@@ -0,0 +1,73 @@
+import glob
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import fitz  # PyMuPDF
+from langchain.schema import Document
+
+
+def corpus_paths(source):
+    # A single PDF, or every PDF in a directory of macro reports
+    if os.path.isdir(source):
+        paths = sorted(glob.glob(os.path.join(source, "*.pdf")))
+        if not paths:
+            raise ValueError(f"no PDF files found in {source}")
+        return paths
+    return [source]
+
+
+def format_text(text):
+    return text.replace('\n', ' ').strip()
+
+
+def page_ranges(paths, pages_per_task):
+    for path in paths:
+        with fitz.open(path) as doc:
+            page_count = doc.page_count
+        for start in range(0, page_count, pages_per_task):
+            yield path, start, min(start + pages_per_task, page_count)
+
+
+def extract_range(task):
+    # Runs in a worker process; returns only non-empty pages of one range
+    path, start, end = task
+    pages = []
+    with fitz.open(path) as doc:
+        for page_number in range(start, end):
+            text = format_text(doc.load_page(page_number).get_text())
+            if text:
+                pages.append((page_number + 1, text))
+    return path, pages
+
+
+def iter_documents(paths, workers=None, pages_per_task=32, max_in_flight=None):
+    # Page ranges are extracted in a process pool and yielded in corpus order.
+    # At most max_in_flight ranges are pending, so memory stays bounded no
+    # matter how many pages the corpus has.
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    tasks = page_ranges(paths, pages_per_task)
+
+    # Spawn rather than fork: the pipeline calls this from worker threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(extract_range, task))
+            if len(pending) >= max_in_flight:
+                break
+        while pending:
+            path, pages = pending.popleft().result()
+            task = next(tasks, None)
+            if task is not None:
+                pending.append(executor.submit(extract_range, task))
+            for page_number, text in pages:
+                yield Document(
+                    page_content=text,
+                    metadata={
+                        'source': os.path.basename(path),
+                        'page_number': page_number,
+                        'char_count': len(text),
+                    }
+                )
@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from langchain.prompts import PromptTemplate
+from langchain.llms import OpenAI
+from langchain.embeddings import OpenAIEmbeddings
+from langchain_openai import ChatOpenAI
+from industrypeer import IndustryPeerAnalysis
+from macroanalysis import MacroeconomicAnalyzer
+from newsanalyst import NewsAnalyzer
+from technicalanalyst import TechnicalAnalysisAnalyzer
+from financialdata import FinancialDataFetcher
+from ohlcvstore import OHLCVStore
+from embeddingstore import EmbeddingStore
+from llmcache import cached_stream
+import tracing
+
+# A single macro report, or a directory of them
+PDF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "US_Economic_Forecast_Deloitte.pdf")
+
+# Per-stage timeout in seconds; a stage that runs longer is reported as unavailable
+STAGE_TIMEOUT = 600
+
+UNAVAILABLE = "Unavailable"
+
+STAGE_NAMES = (
+    "Industry Analysis",
+    "Macroeconomic Analysis",
+    "News Analysis",
+    "Technical Analysis",
+)
+
+# Create the Langchain prompt
+RECOMMENDATION_PROMPT = PromptTemplate(
+    input_variables=["combined_analysis"],
+    template="""
+    You are a financial analyst with expertise in stock market analysis. Based on the following combined analysis of the company, provide a detailed investment recommendation:
+
+    {combined_analysis}
+
+    Output should include:
+    - A summary of the investment outlook considering the factors mentioned above.
+    - Clear and specific investment strategy for short-term traders, long-term investors, and current holders.
+    - Any risks or opportunities identified for the stock.
+    - Be as specific as possible, including potential price targets, trends to watch, and any cautionary advice for investors.
+    """
+)
+
+
+class SharedResources:
+    # Work that every report can share: peer financials (disk cache with per-ticker
+    # locking), the OHLCV bar store, and the macro FAISS index, loaded once. Holds
+    # no API key; the key of whichever report first needs the index builds it.
+    def __init__(self, pdf_path=PDF_PATH, macro_retry_after=300):
+        self.pdf_path = pdf_path
+        self.macro_retry_after = macro_retry_after
+        self.fetcher = FinancialDataFetcher()
+        self.ohlcv_store = OHLCVStore()
+        self._macro_vectorstore = None
+        self._macro_error = None
+        self._macro_failed_at = 0.0
+        self._macro_lock = threading.Lock()
+
+    def macro_vectorstore(self, openai_api_key):
+        with self._macro_lock:
+            # A failed build is remembered so later reports' macro stages fail fast
+            # instead of re-ingesting the corpus one at a time; a long-lived
+            # service tries again once macro_retry_after seconds have passed
+            if self._macro_error is not None and time.monotonic() - self._macro_failed_at < self.macro_retry_after:
+                raise self._macro_error
+            if self._macro_vectorstore is None:
+                analyzer = MacroeconomicAnalyzer(self.pdf_path, "", openai_api_key)
+                try:
+                    vectorstore = analyzer.prepare_vectorstore()
+                except Exception as e:
+                    self._macro_error = e
+                    self._macro_failed_at = time.monotonic()
+                    raise
+                # The index outlives this key, so drop the client that holds it;
+                # analyzers embed their questions through their own EmbeddingStore
+                vectorstore.embedding_function = None
+                self._macro_vectorstore = vectorstore
+            return self._macro_vectorstore
+
+
+class ReportPipeline:
+    def __init__(self, openai_api_key, resources=None, stage_timeout=STAGE_TIMEOUT):
+        self.openai_api_key = openai_api_key
+        self.resources = resources or SharedResources()
+        self.stage_timeout = stage_timeout
+        # Clients are built once here and shared by every stage and report this
+        # pipeline runs, with the same models and settings the analyzers default to
+        self.chat_model = ChatOpenAI(openai_api_key=openai_api_key, model="gpt-4")
+        self.news_model = ChatOpenAI(openai_api_key=openai_api_key, model="gpt-4o")
+        self.macro_llm = ChatOpenAI(openai_api_key=openai_api_key, model="gpt-4", temperature=0)
+        self.embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
+        self.embedding_store = EmbeddingStore(self.embeddings)
+        self.recommendation_llm = OpenAI(openai_api_key=openai_api_key)
+        self.stages = dict(zip(STAGE_NAMES, (
+            self.run_industry_analysis,
+            self.run_macro_analysis,
+            self.run_news_analysis,
+            self.run_technical_analysis,
+        )))
+
+    def run_industry_analysis(self, company):
+        Industry = IndustryPeerAnalysis(company, self.openai_api_key, fetcher=self.resources.fetcher, model=self.chat_model)
+        Industry.analyze()
+        return Industry.get_result()
+
+    def run_macro_analysis(self, company):
+        macroanalyzer = MacroeconomicAnalyzer(
+            self.resources.pdf_path, company, self.openai_api_key,
+            retrieval_mode="hybrid",
+            vectorstore=self.resources.macro_vectorstore(self.openai_api_key),
+            llm=self.macro_llm,
+            embeddings=self.embeddings,
+            embedding_store=self.embedding_store,
+        )
+        macroanalyzer.analyze()
+        return macroanalyzer.get_analysis()
+
+    def run_news_analysis(self, company):
+        news_analyzer = NewsAnalyzer(self.openai_api_key, model=self.news_model)
+        return news_analyzer.analyze_news(company)
+
+    def run_technical_analysis(self, company):
+        ta_analyzer = TechnicalAnalysisAnalyzer(self.openai_api_key, store=self.resources.ohlcv_store, model=self.chat_model)
+        return ta_analyzer.analyze_technical_data(company)
+
+    @staticmethod
+    def stage_failed(result):
+        # iter_stages reports a failed or timed-out stage in place of its result
+        return isinstance(result, str) and result.startswith(UNAVAILABLE)
+
+    @staticmethod
+    def run_stage(name, stage, company):
+        with tracing.span("stage", stage=name, company=company):
+            return stage(company)
+
+    def iter_stages(self, company):
+        # The stages are independent and mostly wait on network I/O, so they all
+        # start at once and each result is yielded as soon as its stage finishes;
+        # a failed or timed-out stage doesn't stop the others
+        executor = ThreadPoolExecutor(max_workers=len(self.stages))
+        futures = {
+            executor.submit(tracing.propagate(self.run_stage), name, stage, company): name
+            for name, stage in self.stages.items()
+        }
+        pending = dict(futures)
+        try:
+            for future in as_completed(futures, timeout=self.stage_timeout):
+                name = pending.pop(future)
+                try:
+                    yield name, future.result()
+                except Exception as e:
+                    yield name, f"{UNAVAILABLE} ({type(e).__name__}: {e})"
+        except FuturesTimeoutError:
+            for name in pending.values():
+                yield name, f"{UNAVAILABLE} (timed out after {self.stage_timeout} seconds)"
+        finally:
+            # Don't block on stages that are still running past the timeout
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def run_stages(self, company):
+        results = dict(self.iter_stages(company))
+        return {name: results[name] for name in STAGE_NAMES}
+
+    @staticmethod
+    def combine_results(results):
+        # Combine all analysis results, in stage order
+        return "\n".join(f"""
+    {name}:
+    {results[name]}
+""" for name in STAGE_NAMES if name in results)
+
+    def stream_recommendation(self, results):
+        # Stream the recommendation from the pipeline's OpenAI client
+        yield from cached_stream(RECOMMENDATION_PROMPT, self.recommendation_llm, "final.recommendation", {"combined_analysis": self.combine_results(results)})
+
+    def run(self, company):
+        with tracing.span("report", company=company):
+            results = self.run_stages(company)
+            return {
+                "company": company,
+                "sections": results,
+                "recommendation": "".join(self.stream_recommendation(results)),
+            }
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+# Statement rows the engine reads from yfinance. Row labels vary between
+# companies, so each line item lists the labels to try in order.
+LINE_ITEMS = {
+    "revenue": ("financials", ("Total Revenue", "Operating Revenue")),
+    "gross_profit": ("financials", ("Gross Profit",)),
+    "operating_income": ("financials", ("Operating Income", "EBIT")),
+    "ebit": ("financials", ("EBIT", "Operating Income")),
+    "ebitda": ("financials", ("EBITDA", "Normalized EBITDA")),
+    "net_income": ("financials", ("Net Income", "Net Income Common Stockholders")),
+    "interest_expense": ("financials", ("Interest Expense", "Interest Expense Non Operating")),
+    "total_assets": ("balance_sheet", ("Total Assets",)),
+    "current_assets": ("balance_sheet", ("Current Assets",)),
+    "current_liabilities": ("balance_sheet", ("Current Liabilities",)),
+    "inventory": ("balance_sheet", ("Inventory",)),
+    "cash": ("balance_sheet", ("Cash And Cash Equivalents", "Cash Cash Equivalents And Short Term Investments")),
+    "total_debt": ("balance_sheet", ("Total Debt",)),
+    "equity": ("balance_sheet", ("Stockholders Equity", "Common Stock Equity", "Total Equity Gross Minority Interest")),
+    "operating_cash_flow": ("cashflow", ("Operating Cash Flow",)),
+    "capital_expenditure": ("cashflow", ("Capital Expenditure",)),
+    "free_cash_flow": ("cashflow", ("Free Cash Flow",)),
+}
+
+# Fields taken from ticker.info rather than the statements
+INFO_ITEMS = {
+    "market_cap": "marketCap",
+}
+
+
+def _div(numerator, denominator):
+    # Element-wise division that yields NaN instead of inf for zero denominators
+    return numerator / denominator.where(denominator != 0)
+
+
+def _free_cash_flow(d):
+    return d["free_cash_flow"].fillna(d["operating_cash_flow"] + d["capital_expenditure"])
+
+
+RATIOS = {
+    "Gross Margin": lambda d: _div(d["gross_profit"], d["revenue"]),
+    "Operating Margin": lambda d: _div(d["operating_income"], d["revenue"]),
+    "Net Profit Margin": lambda d: _div(d["net_income"], d["revenue"]),
+    "EBITDA Margin": lambda d: _div(d["ebitda"], d["revenue"]),
+    "Return on Equity": lambda d: _div(d["net_income"], d["equity"]),
+    "Return on Assets": lambda d: _div(d["net_income"], d["total_assets"]),
+    "Current Ratio": lambda d: _div(d["current_assets"], d["current_liabilities"]),
+    "Quick Ratio": lambda d: _div(d["current_assets"] - d["inventory"].fillna(0), d["current_liabilities"]),
+    "Cash Ratio": lambda d: _div(d["cash"], d["current_liabilities"]),
+    "Debt to Equity": lambda d: _div(d["total_debt"], d["equity"]),
+    "Debt to Assets": lambda d: _div(d["total_debt"], d["total_assets"]),
+    "Interest Coverage": lambda d: _div(d["ebit"], d["interest_expense"].abs()),
+    "Asset Turnover": lambda d: _div(d["revenue"], d["total_assets"]),
+    "Free Cash Flow Margin": lambda d: _div(_free_cash_flow(d), d["revenue"]),
+    "Free Cash Flow Yield": lambda d: _div(_free_cash_flow(d), d["market_cap"]),
+    "Price to Earnings": lambda d: _div(d["market_cap"], d["net_income"]),
+    "Price to Sales": lambda d: _div(d["market_cap"], d["revenue"]),
+    "Price to Book": lambda d: _div(d["market_cap"], d["equity"]),
+}
+
+
+def _latest_value(frame, labels):
+    if frame is None or frame.empty:
+        return np.nan
+    for label in labels:
+        if label in frame.index:
+            value = frame.loc[label].iloc[0]
+            return float(value) if pd.notna(value) else np.nan
+    return np.nan
+
+
+def extract_line_items(statements):
+    # statements maps ticker -> {"balance_sheet", "financials", "cashflow", "info"}
+    rows = {}
+    for ticker, data in statements.items():
+        row = {
+            item: _latest_value(data.get(statement), labels)
+            for item, (statement, labels) in LINE_ITEMS.items()
+        }
+        info = data.get("info") or {}
+        for item, key in INFO_ITEMS.items():
+            value = info.get(key)
+            row[item] = float(value) if isinstance(value, (int, float)) else np.nan
+        rows[ticker] = row
+    columns = list(LINE_ITEMS) + list(INFO_ITEMS)
+    return pd.DataFrame.from_dict(rows, orient="index", columns=columns, dtype="float64")
+
+
+def compute_ratios(line_items, ratio_names=None):
+    # One column per ratio, one row per ticker, all tickers computed at once
+    names = ratio_names or list(RATIOS)
+    return pd.DataFrame({name: RATIOS[name](line_items) for name in names}, index=line_items.index)
+
+
+def _normalize(name):
+    return "".join(ch for ch in name.lower() if ch.isalnum())
+
+
+def match_ratio_names(names):
+    # Map free-form ratio names (e.g. from an LLM) onto the engine's catalogue
+    catalogue = {_normalize(name): name for name in RATIOS}
+    matched = []
+    for name in names:
+        ratio = catalogue.get(_normalize(name))
+        if ratio and ratio not in matched:
+            matched.append(ratio)
+    return matched
@@ -0,0 +1,255 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from batch import read_watchlist
+from financialdata import CACHE_DIR
+from llmscheduler import BATCH, INTERACTIVE, request_priority
+from pipeline import STAGE_NAMES, ReportPipeline, SharedResources
+import tracing
+
+# A stored report younger than this is served without running the pipeline again
+REPORT_MAX_AGE = int(os.environ.get("VALUATEGPT_REPORT_MAX_AGE", 6 * 3600))
+# Reports with a failed or timed-out stage are only served for this long
+DEGRADED_MAX_AGE = int(os.environ.get("VALUATEGPT_DEGRADED_REPORT_MAX_AGE", 600))
+# How often the popular-ticker list is checked for reports that need refreshing
+PREWARM_INTERVAL = int(os.environ.get("VALUATEGPT_PREWARM_INTERVAL", 3600))
+
+
+def normalize_company(company):
+    # "aapl " and "AAPL" are the same request
+    return company.strip().upper()
+
+
+def popular_tickers():
+    # VALUATEGPT_POPULAR_TICKERS is either a comma-separated list or a watchlist file
+    value = os.environ.get("VALUATEGPT_POPULAR_TICKERS", "")
+    if os.path.isfile(value):
+        return read_watchlist(value)
+    return list(dict.fromkeys(t.strip() for t in value.split(",") if t.strip()))
+
+
+class ReportStore:
+    # Job queue and finished reports in one SQLite file. Sections and the partial
+    # recommendation are written as they arrive, so any session can poll a job.
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, "reports.sqlite3")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, company TEXT NOT NULL, status TEXT NOT NULL, "
+            "priority INTEGER NOT NULL, created REAL NOT NULL, started REAL, finished REAL, "
+            "sections TEXT NOT NULL DEFAULT '{}', recommendation TEXT NOT NULL DEFAULT '', error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority, id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS reports ("
+            "company TEXT PRIMARY KEY, job_id INTEGER NOT NULL, generated REAL NOT NULL, "
+            "complete INTEGER NOT NULL, report TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def submit(self, company, priority=INTERACTIVE):
+        # A request for a ticker that already has a queued or running job joins that job
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, priority FROM jobs WHERE company = ? AND status IN ('queued', 'running') ORDER BY id LIMIT 1",
+                (company,),
+            ).fetchone()
+            if row is not None:
+                if priority < row[1]:
+                    self._conn.execute("UPDATE jobs SET priority = ? WHERE id = ?", (priority, row[0]))
+                    self._conn.commit()
+                return row[0]
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (company, status, priority, created) VALUES (?, 'queued', ?, ?)",
+                (company, priority, time.time()),
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def claim(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, company, priority FROM jobs WHERE status = 'queued' ORDER BY priority, id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ?", (time.time(), row[0]))
+            self._conn.commit()
+            return row
+
+    def requeue_running(self):
+        # Jobs left running by a process that exited start over
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = 'queued', sections = '{}', recommendation = '' WHERE status = 'running'")
+            self._conn.commit()
+
+    def update_section(self, job_id, name, result):
+        with self._lock:
+            row = self._conn.execute("SELECT sections FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            sections = json.loads(row[0])
+            sections[name] = result
+            self._conn.execute("UPDATE jobs SET sections = ? WHERE id = ?", (json.dumps(sections, default=str), job_id))
+            self._conn.commit()
+
+    def update_recommendation(self, job_id, text):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET recommendation = ? WHERE id = ?", (text, job_id))
+            self._conn.commit()
+
+    def finish(self, job_id, report, complete=True):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'done', finished = ?, sections = ?, recommendation = ? WHERE id = ?",
+                (now, json.dumps(report["sections"], default=str), report["recommendation"], job_id),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO reports (company, job_id, generated, complete, report) VALUES (?, ?, ?, ?, ?)",
+                (report["company"], job_id, now, int(complete), json.dumps(report, default=str)),
+            )
+            self._conn.commit()
+
+    def fail(self, job_id, error):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = 'error', finished = ?, error = ? WHERE id = ?", (time.time(), error, job_id))
+            self._conn.commit()
+
+    def job(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, company, status, created, started, finished, sections, recommendation, error FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "company": row[1],
+            "status": row[2],
+            "created": row[3],
+            "started": row[4],
+            "finished": row[5],
+            "sections": json.loads(row[6]),
+            "recommendation": row[7],
+            "error": row[8],
+        }
+
+    def report(self, company, max_age=None):
+        with self._lock:
+            row = self._conn.execute("SELECT generated, complete, report FROM reports WHERE company = ?", (company,)).fetchone()
+        if row is None:
+            return None
+        age = time.time() - row[0]
+        if max_age is not None and not row[1]:
+            max_age = min(max_age, DEGRADED_MAX_AGE)
+        if max_age is not None and age > max_age:
+            return None
+        return {**json.loads(row[2]), "generated": row[0], "age": age}
+
+
+class ReportService:
+    # Runs queued reports on background threads. The peer data cache, the OHLCV
+    # store and the macro index live as long as the service, so every session
+    # reuses them. API keys stay in memory only while their job is queued or
+    # running and are never written to the store; jobs without one fall back to
+    # $OPENAI_API_KEY.
+    def __init__(self, store=None, workers=2, max_age=REPORT_MAX_AGE, default_api_key=None, poll_interval=1.0, flush_interval=0.5):
+        self.store = store or ReportStore()
+        self.workers = workers
+        self.max_age = max_age
+        self.default_api_key = default_api_key or os.environ.get("OPENAI_API_KEY")
+        self.poll_interval = poll_interval
+        self.flush_interval = flush_interval
+        self._keys = {}
+        self.resources = SharedResources()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._threads = []
+
+    def start(self, prewarm_tickers=None, prewarm_interval=PREWARM_INTERVAL):
+        self.store.requeue_running()
+        for i in range(self.workers):
+            self._threads.append(threading.Thread(target=self._work, name=f"report-worker-{i}", daemon=True))
+        if prewarm_tickers and self.default_api_key:
+            self._threads.append(threading.Thread(
+                target=self._prewarm_loop, args=(prewarm_tickers, prewarm_interval), name="report-prewarm", daemon=True,
+            ))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def cached_report(self, company):
+        return self.store.report(normalize_company(company), self.max_age)
+
+    def submit(self, company, openai_api_key=None, priority=INTERACTIVE):
+        with self._lock:
+            job_id = self.store.submit(normalize_company(company), priority)
+            if openai_api_key:
+                self._keys.setdefault(job_id, openai_api_key)
+        self._wakeup.set()
+        return job_id
+
+    def prewarm(self, tickers, refresh_before=0):
+        # Queue reports for tickers that have none, or whose report expires within
+        # refresh_before seconds; they run after any queued user requests
+        max_age = max(self.max_age - refresh_before, 0)
+        return [
+            self.submit(ticker, priority=BATCH)
+            for ticker in tickers
+            if self.store.report(normalize_company(ticker), max_age) is None
+        ]
+
+    def _prewarm_loop(self, tickers, interval):
+        while True:
+            try:
+                self.prewarm(tickers, refresh_before=interval)
+            except Exception as e:
+                print(f"Prewarm failed: {type(e).__name__}: {e}")
+            time.sleep(interval)
+
+    def _work(self):
+        while True:
+            job = self.store.claim()
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run_job(*job)
+
+    def _run_job(self, job_id, company, priority):
+        with self._lock:
+            openai_api_key = self._keys.get(job_id) or self.default_api_key
+        try:
+            if not openai_api_key:
+                raise RuntimeError("no OpenAI API key is available for this job; please submit it again")
+            # Built per job so the key is dropped with it once the job ends
+            pipeline = ReportPipeline(openai_api_key, self.resources)
+            # LLM and embedding calls queue at the job's priority, so prewarm
+            # jobs give way to interactive ones in the shared scheduler
+            with request_priority(priority), tracing.span("job", company=company, job_id=job_id):
+                results = {}
+                for name, result in pipeline.iter_stages(company):
+                    results[name] = result
+                    self.store.update_section(job_id, name, result)
+                results = {name: results[name] for name in STAGE_NAMES}
+
+                # Write the recommendation as it streams so pollers see it grow
+                recommendation = ""
+                flushed = time.monotonic()
+                for chunk in pipeline.stream_recommendation(results):
+                    recommendation += chunk
+                    if time.monotonic() - flushed >= self.flush_interval:
+                        self.store.update_recommendation(job_id, recommendation)
+                        flushed = time.monotonic()
+                complete = not any(pipeline.stage_failed(result) for result in results.values())
+                self.store.finish(job_id, {"company": company, "sections": results, "recommendation": recommendation}, complete)
+        except Exception as e:
+            self.store.fail(job_id, f"{type(e).__name__}: {e}")
+        finally:
+            with self._lock:
+                self._keys.pop(job_id, None)
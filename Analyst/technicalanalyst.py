@@ -1,47 +1,74 @@
-import yfinance as yf
 import pandas as pd
 from langchain.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
-from langchain.schema.output_parser import StrOutputParser
+from llmcache import cached_chain
+from ohlcvstore import OHLCVStore
+import tracing
 
 # Step 1: Collecting Technical Analysis Data using Yahoo Finance
-def get_technical_analysis_data(ticker):
-    # Fetch historical data (weekly interval for last 1 year)
-    stock_data = yf.download(ticker, period="1y", interval="1wk")
-    
-    if stock_data.empty:
-        raise ValueError("No data downloaded. Check your internet connection or ticker symbol.")
-    
+def compute_indicators(close):
+    # close has one column per ticker, so every indicator is computed for all tickers at once
+    close = close.ffill()
+    indicators = {}
+
     # Calculate 50-week SMA
-    stock_data["SMA50"] = stock_data["Close"].rolling(window=50).mean()
+    indicators["SMA50"] = close.rolling(window=50).mean()
 
     # Calculate 20-week EMA
-    stock_data["EMA20"] = stock_data["Close"].ewm(span=20, adjust=False).mean()
+    indicators["EMA20"] = close.ewm(span=20, adjust=False).mean()
 
     # Calculate 12-week EMA & 26-week EMA for MACD
-    stock_data["EMA12"] = stock_data["Close"].ewm(span=12, adjust=False).mean()
-    stock_data["EMA26"] = stock_data["Close"].ewm(span=26, adjust=False).mean()
+    ema12 = close.ewm(span=12, adjust=False).mean()
+    ema26 = close.ewm(span=26, adjust=False).mean()
 
     # Calculate MACD and Signal Line
-    stock_data["MACD"] = stock_data["EMA12"] - stock_data["EMA26"]
-    stock_data["Signal_Line"] = stock_data["MACD"].ewm(span=9, adjust=False).mean()
+    indicators["MACD"] = ema12 - ema26
+    indicators["Signal_Line"] = indicators["MACD"].ewm(span=9, adjust=False).mean()
 
     # Calculate RSI (Relative Strength Index)
-    delta = stock_data["Close"].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-    rs = gain / loss
-    stock_data["RSI"] = 100 - (100 / (1 + rs))
-    
-    # Get current price
-    current_price = yf.Ticker(ticker).history(period="1d")["Close"].iloc[-1]
-    
+    delta = close.diff()
+    gain = delta.clip(lower=0).rolling(window=14).mean()
+    loss = (-delta.clip(upper=0)).rolling(window=14).mean()
+    indicators["RSI"] = 100 - (100 / (1 + gain / loss))
+
+    return indicators
+
+def get_technical_indicators(tickers, store=None):
+    # Weekly bars for every ticker come from the local store, topped up with one batched download
+    store = store or OHLCVStore()
+    with tracing.span("technical.fetch", tickers=len(tickers)):
+        store.update(tickers)
+        close = store.closes(tickers)
+
+    if close.empty:
+        raise ValueError("No data downloaded. Check your internet connection or ticker symbol.")
+
+    # Latest value of each indicator, one row per ticker
+    latest = pd.DataFrame({name: frame.iloc[-1] for name, frame in compute_indicators(close).items()})
+
+    # Get current price from the last stored bar
+    latest["current_price"] = close.ffill().iloc[-1]
+    return latest
+
+def get_technical_analysis_data(ticker, store=None):
+    store = store or OHLCVStore()
+    store.update([ticker])
+    stock_data = store.load(ticker)
+
+    if stock_data.empty:
+        raise ValueError("No data downloaded. Check your internet connection or ticker symbol.")
+
+    for name, frame in compute_indicators(stock_data[["Close"]]).items():
+        stock_data[name] = frame["Close"]
+    current_price = stock_data["Close"].iloc[-1]
+
     return stock_data, current_price
 
 # Step 2: Setting up Langchain for Technical Analysis Insights
 class TechnicalAnalysisAnalyzer:
-    def __init__(self, openai_api_key: str, model_name: str = "gpt-4"):
-        self.model = ChatOpenAI(openai_api_key=openai_api_key, model=model_name)
+    def __init__(self, openai_api_key: str, model_name: str = "gpt-4", store: OHLCVStore = None, model: ChatOpenAI = None):
+        self.store = store
+        self.model = model or ChatOpenAI(openai_api_key=openai_api_key, model=model_name)
         
         self.analysis_prompt = ChatPromptTemplate.from_messages([
             ("system", "You're a stock market expert with vast knowledge in technical analysis. Your task is to analyze the stock's technical indicators and give an insightful prediction."),
@@ -49,11 +76,12 @@ class TechnicalAnalysisAnalyzer:
         ])
 
     def analyze_technical_data(self, ticker):
+        ticker = ticker.upper()
         # Get technical analysis data
-        stock_data, current_price = get_technical_analysis_data(ticker)
+        indicators = get_technical_indicators([ticker], self.store)
         
         # Extract the latest data for prompt
-        latest_data = stock_data.iloc[-1]
+        latest_data = indicators.loc[ticker]
         
         # Generate prompt input
         analysis_input = {
@@ -63,11 +91,11 @@ class TechnicalAnalysisAnalyzer:
             "MACD": latest_data["MACD"],
             "Signal_Line": latest_data["Signal_Line"],
             "RSI": latest_data["RSI"],
-            "current_price": current_price
+            "current_price": latest_data["current_price"]
         }
         
         # Use Langchain to get analysis
-        chain = self.analysis_prompt | self.model | StrOutputParser()
+        chain = cached_chain(self.analysis_prompt, self.model, "technical.analysis")
         response = chain.invoke(analysis_input)
         
         return response
@@ -0,0 +1,40 @@
+import random
+import pytest
+
+newsanalyst = pytest.importorskip("newsanalyst")
+
+
+def words(seed, count):
+    rng = random.Random(seed)
+    return [f"w{rng.randrange(100000)}" for _ in range(count)]
+
+
+def jaccard(a, b):
+    a, b = newsanalyst.shingles(a), newsanalyst.shingles(b)
+    return len(a & b) / len(a | b)
+
+
+def test_near_duplicate_wire_copies_are_collapsed():
+    story = " ".join(words(1, 300))
+    copy = story + " " + " ".join(words(2, 10))
+    assert jaccard(story, copy) > 0.85
+    kept = newsanalyst.deduplicate_articles([{"content": story}, {"content": copy}])
+    assert len(kept) == 1
+
+
+def test_half_different_articles_are_kept_and_estimated_accurately():
+    errors = []
+    for seed in range(50):
+        shared = words(seed * 3, 150)
+        first = " ".join(shared + words(seed * 3 + 1, 150))
+        second = " ".join(shared + words(seed * 3 + 2, 150))
+        true = jaccard(first, second)
+        estimate = newsanalyst.signature_similarity(
+            newsanalyst.minhash_signature(first), newsanalyst.minhash_signature(second)
+        )
+        errors.append(estimate - true)
+        kept = newsanalyst.deduplicate_articles([{"content": first}, {"content": second}])
+        assert len(kept) == 2
+    # A 64-permutation MinHash has a standard error of about 0.06 at this similarity
+    assert max(abs(e) for e in errors) < 0.25
+    assert abs(sum(errors) / len(errors)) < 0.05
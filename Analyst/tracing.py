@@ -0,0 +1,124 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+
+_current_span = contextvars.ContextVar("valuategpt_span", default=None)
+
+
+class Span:
+    # Children finishing on worker threads add to their parent's counters
+    _lock = threading.Lock()
+
+    def __init__(self, name, parent=None, **attrs):
+        self.name = name
+        self.parent = parent
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.attrs = attrs
+        # tokens_in, tokens_out (or tokens_in_est, tokens_out_est when the provider
+        # reported no usage), cache_hits, cache_misses, http_calls; a finished
+        # span's counters include those of its children
+        self.counters = Counter()
+        self.error = None
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms = None
+
+    def record(self, **counts):
+        with self._lock:
+            self.counters.update(counts)
+
+    def finish(self):
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 3)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": self.duration_ms,
+            "attrs": self.attrs,
+            **self.counters,
+            "error": self.error,
+        }
+
+
+class Tracer:
+    # Collects finished spans in memory and, when a path is set, appends them as JSON lines
+    def __init__(self, path=None, keep=10000):
+        self.path = path
+        self.spans = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def start_span(self, name, **attrs):
+        # For code that can't hold a context manager open, e.g. generators
+        return Span(name, _current_span.get(), **attrs)
+
+    def end_span(self, span, error=None):
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        span.finish()
+        with self._lock:
+            # Roll counters up so e.g. a stage span carries its LLM, cache and HTTP totals
+            if span.parent is not None:
+                span.parent.record(**span.counters)
+            self.spans.append(span)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+    @contextmanager
+    def span(self, name, **attrs):
+        span = self.start_span(name, **attrs)
+        token = _current_span.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end_span(span, error)
+
+
+_tracer = Tracer(os.environ.get("VALUATEGPT_TRACE_PATH"))
+
+
+def get_tracer():
+    return _tracer
+
+
+def set_trace_path(path):
+    _tracer.path = path
+
+
+def span(name, **attrs):
+    return _tracer.span(name, **attrs)
+
+
+def record(**counts):
+    # Adds to the innermost open span; a no-op outside of any span
+    current = _current_span.get()
+    if current is not None:
+        current.record(**counts)
+
+
+def propagate(fn):
+    # Worker threads don't inherit context variables, so carry the caller's over
+    # (the current span and the LLM request priority). Each call gets its own
+    # copy, since one context can't be entered by several threads at once.
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run